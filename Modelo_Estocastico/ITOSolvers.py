@@ -5,15 +5,12 @@ Created on 09/03/15
 by fccoelho
 license: GPL V3 or Later
 """
-from random import normalvariate
 from math import sqrt
 import numpy as np
-from matplotlib import pyplot as P
-import sympy
-from sympy import matrices as M
+from streams import as_streams, increments
 
 
-def EulerMaruyama(xstart, ystart, xfinish, nsteps, f1, f2, params):
+def EulerMaruyama(xstart, ystart, xfinish, nsteps, f1, f2, params, rng=None):
     """
     Euler-Maruyama solver
     :param xstart: initial x value
@@ -23,56 +20,358 @@ def EulerMaruyama(xstart, ystart, xfinish, nsteps, f1, f2, params):
     :param f1: function representing the deterministic part of the model
     :param f2: function representing the deterministic part of the model
     :param params: tuple of parameters to be passed to f1 and f2
+    :param rng: seed for the Wiener increments: int, `numpy.random.SeedSequence` or `numpy.random.Generator`
     :return:
     """
     sol = [ystart]
     xvals = [xstart]
     h = (xfinish - xstart) / nsteps
+    dW = np.sqrt(h) * as_streams(rng, 1)[0].standard_normal(nsteps)
     for step in range(nsteps):
-        sol.append(sol[-1] + h * f1(sol[-1], *params) + np.sqrt(h) * f2(sol[-1], *params) * normalvariate(0, 1))
+        sol.append(sol[-1] + h * f1(sol[-1], *params) + f2(sol[-1], *params) * dW[step])
         xvals.append(xvals[-1] + h)
     return xvals, sol
 
 
-def EulerMaruyamaMatrix(xstart, ystart, xfinish, nsteps, mu, B, params, vsymbols):
+def _lambdify_batch(vsymbols, expr):
     """
-    Euler-Maruyama solver for multidimensional models. Model is passed in matrix form
+    Lambdify the nonzero entries of a sympy matrix into a NumPy function evaluated over a batch.
+    :param vsymbols: symbols of the function arguments
+    :param expr: sympy Matrix
+    :return: function which takes each argument as an array of length k (one value per replicate)
+     and returns a float64 array of shape (k,) + expr.shape
+    """
+    import sympy
+    shape = expr.shape
+    nz = [(i, j) for i in range(shape[0]) for j in range(shape[1]) if expr[i, j] != 0]
+    rows = [i for i, j in nz]
+    cols = [j for i, j in nz]
+    f = sympy.lambdify(vsymbols, [expr[i, j] for i, j in nz], 'numpy')
+
+    def func(*args):
+        k = len(args[0])
+        out = np.zeros((k,) + shape)
+        if nz:
+            out[:, rows, cols] = np.column_stack([np.broadcast_to(v, (k,)) for v in f(*args)])
+        return out
+
+    return func
+
+
+#: ways of keeping the states non-negative after each step
+POSITIVITY = {'clip': lambda x: np.maximum(x, 0),  # truncated scheme: projects negative states onto zero
+              'reflect': np.abs,  # reflected scheme: mirrors them at zero
+              }
+
+
+def _euler_maruyama_steps(xstart, ystart, xfinish, nsteps, increment, transitions, reps, rng, positivity=None,
+                          counter=None):
+    """
+    Euler-Maruyama stepping loop shared by the multidimensional solvers.
+    :param increment: function of (state block, h, dW) returning the new state block, and with a
+     `counter` also the firings of each transition in the step, of shape (block size, transitions)
+    :param transitions: number of independent Wiener processes
+    :param reps: number of replicates or None for a single path
+    :param rng: seed or per-replicate generators, see `streams.as_streams`
+    :param positivity: None, or a key of `POSITIVITY` applied to the states after each step
+    :param counter: `recorder.EventCounter` receiving the firings of the valid steps
+    :return: xvals, sol, as described in `EulerMaruyamaMatrix`
+    """
+    if positivity is not None and positivity not in POSITIVITY:
+        raise ValueError("positivity must be one of {}, got {}".format(sorted(POSITIVITY), positivity))
+    y0 = np.array(ystart, dtype=float).ravel()
+    nreps = 1 if reps is None else reps
+    h = (xfinish - xstart) / float(nsteps)
+    xvals = xstart + h * np.arange(nsteps + 1)
+    sol = np.full((nsteps + 1, nreps, y0.size), np.nan)
+    sol[0] = y0
+    alive = np.arange(nreps)
+    noise = increments(as_streams(rng, nreps), (transitions,), nsteps)
+    step = 1
+    while step < (nsteps + 1) and alive.size:
+        current_state = sol[step - 1, alive]
+        dW = np.sqrt(h) * next(noise)[alive]
+        if counter is not None:
+            new_state, fired = increment(current_state, h, dW)
+        else:
+            new_state = increment(current_state, h, dW)
+        if positivity is not None:
+            new_state = POSITIVITY[positivity](new_state)
+        valid = np.isfinite(new_state).all(axis=1) & (new_state >= 0).all(axis=1)
+        if counter is not None:
+            for r, f in zip(alive[valid], fired[valid]):
+                counter.add_counts(r, xvals[step - 1], f)
+        sol[step, alive[valid]] = new_state[valid]
+        alive = alive[valid]
+        step += 1
+    if reps is None:
+        last = step if alive.size else step - 1
+        return xvals[:last], sol[:last, 0]
+    return xvals, sol
+
+
+def EulerMaruyamaMatrix(xstart, ystart, xfinish, nsteps, mu, B, params, vsymbols, reps=None, rng=None,
+                        positivity=None):
+    """
+    Euler-Maruyama solver for multidimensional models. Model is passed in matrix form.
+    Drift and diffusion are lambdified once to NumPy functions and the trajectory is
+    kept in a preallocated float64 array, so no sympy arithmetic happens inside the step loop.
+    When `reps` is given, all replicates are advanced together as an (reps, n_states) block.
     :param xstart: initial x value
     :param ystart: initial y value
     :param xfinish: final x value
     :param nsteps: number of steps to simulate between `xstart` and `xfinish`
     :param mu: Mean vector of the model
     :param B: Diffusion matrix for the model
-    :param params: dictionary of parameters to be passed to f1 and f2
-    :param vnames: variable symbols in order of the `ystart` vector
-    :return:
+    :param params: tuple of parameters to be passed to `mu` and `B`
+    :param vsymbols: variable symbols in order of the `ystart` vector, followed by the parameter symbols
+    :param reps: number of replicates to simulate. If None, a single path is simulated.
+    :param rng: seed for the Wiener increments: int, `numpy.random.SeedSequence` or `numpy.random.Generator`,
+     or a list with one generator per replicate (see `streams.replicate_streams`). Each replicate draws
+     from its own spawned child stream, so runs are reproducible however the replicates are batched.
+    :param positivity: keep the states non-negative after each step, instead of stopping the paths
+     which go negative: 'clip' (truncated Euler) or 'reflect' (reflected Euler). See `POSITIVITY`.
+    :return: `xvals` of shape (nsteps+1,) and `sol`. For a single path `sol` has shape (nsteps+1, n_states)
+     and if any state becomes negative or not finite the simulation stops and both are truncated at the
+     last valid step. With `reps`, `sol` has shape (nsteps+1, reps, n_states); a replicate which goes
+     negative or overflows is frozen and its remaining rows are set to NaN while the other replicates keep
+     running. With `positivity`, paths no longer stop at negative states, but still stop if they overflow.
     """
-    transitions = B.shape[1]
-    muf = sympy.lambdify(vsymbols, mu)  # Turn array into a function which can be evaluated
-    Bf = sympy.lambdify(vsymbols, B)
-    sol = sympy.zeros(len(ystart), nsteps)
-    xvals = sympy.zeros(nsteps, 1)
-    sol[:, 0] = ystart
-    xvals[0, 0] = xstart
-    h = (xfinish - xstart) / float(nsteps)
-    dW = sympy.Matrix(np.random.normal(0, 1, (transitions, 1)) * np.sqrt(h))
-    step = 1;
-    current_state = sol[:, 0]
-    while step < (nsteps+1):
-        print(current_state[:4, 0], h)
-        if np.any(np.array(current_state) < 0):
-            sol = sol[:, :-1]
+    muf = _lambdify_batch(vsymbols, mu)  # Turn array into a function which can be evaluated
+    Bf = _lambdify_batch(vsymbols, B)
+    params = tuple(params)
+
+    def increment(state, h, dW):
+        args = tuple(state.T) + params
+        return state + h * muf(*args)[:, :, 0] + np.einsum('rij,rj->ri', Bf(*args), dW)
+
+    return _euler_maruyama_steps(xstart, ystart, xfinish, nsteps, increment, B.shape[1], reps, rng, positivity)
+
+
+def EulerMaruyamaStoich(xstart, ystart, xfinish, nsteps, props, changes, params, vsymbols, reps=None, rng=None,
+                        positivity=None, counter=None):
+    """
+    Euler-Maruyama solver for models given in stoichiometric form, i.e. as a vector of
+    transition propensities `a(x)` and a change matrix `S`, one row per transition.
+    The drift is `S^T a` and the diffusion `S^T diag(sqrt(a)) dW`, so only the propensities
+    are evaluated on each step and `S` is applied as a CSR sparse matrix.
+    This is the Chemical Langevin Equation; propensities are clamped at zero before taking their
+    square roots, so with `positivity` the paths do not stop at negative states. Steps must still be
+    small against the fastest rates, or the explicit step overflows and the path stops.
+    :param xstart: initial x value
+    :param ystart: initial y value
+    :param xfinish: final x value
+    :param nsteps: number of steps to simulate between `xstart` and `xfinish`
+    :param props: sympy Matrix of transition propensities, or a compiled kernel `props(x, params)`
+     as returned by `modelcache.compile_model`
+    :param changes: change matrix with one row per transition (sympy, NumPy or scipy.sparse)
+    :param params: tuple of parameters to be passed to `props`
+    :param vsymbols: variable symbols in order of the `ystart` vector, followed by the parameter symbols.
+     Not used when `props` is a compiled kernel.
+    :param reps: number of replicates to simulate. If None, a single path is simulated.
+    :param rng: seed for the Wiener increments, as in `EulerMaruyamaMatrix`
+    :param positivity: 'clip' or 'reflect', as in `EulerMaruyamaMatrix`
+    :param counter: `recorder.EventCounter` for `reps` replicates (one for a single path), receiving the
+     firings `h a + sqrt(a) dW` of each step, in the bin where it starts. Negative firings count as none,
+     as in `SSASolvers.HybridSSA`.
+    :return: xvals, sol, as in `EulerMaruyamaMatrix`
+    """
+    from scipy import sparse
+    if sparse.issparse(changes):
+        S = sparse.csr_matrix(changes, dtype=float)
+    else:
+        S = sparse.csr_matrix(np.array(changes, dtype=float))
+    params = tuple(params)
+    if callable(props):
+        def af(state):
+            return props(state, params)
+    else:
+        S = S[:props.shape[0]]
+        lf = _lambdify_batch(vsymbols, props)
+
+        def af(state):
+            return lf(*(tuple(state.T) + params))[:, :, 0]
+
+    def increment(state, h, dW):
+        a = np.maximum(af(state), 0)
+        new = state + h * (a @ S) + (np.sqrt(a) * dW) @ S
+        if counter is not None:
+            return new, np.maximum(h * a + np.sqrt(a) * dW, 0)
+        return new
+
+    return _euler_maruyama_steps(xstart, ystart, xfinish, nsteps, increment, S.shape[0], reps, rng, positivity,
+                                 counter)
+
+
+def MilsteinDiagonal(xstart, ystart, xfinish, nsteps, mu, B, params, vsymbols, reps=None, rng=None,
+                     positivity=None):
+    """
+    Milstein solver (strong order 1) for models with diagonal noise, where each state has its own
+    Wiener process and its diffusion depends only on that state: dX_i = mu_i dt + B_ii(X_i) dW_i.
+    The derivatives dB_ii/dX_i are taken symbolically.
+    Arguments and return values are those of `EulerMaruyamaMatrix`; `B` must be a square diagonal matrix.
+    """
+    import sympy
+    n = B.shape[0]
+    if B.shape[1] != n or any(B[i, j] != 0 for i in range(n) for j in range(n) if i != j):
+        raise ValueError("MilsteinDiagonal needs a square diagonal diffusion matrix")
+    muf = _lambdify_batch(vsymbols, mu)
+    diag = sympy.Matrix([B[i, i] for i in range(n)])
+    gf = _lambdify_batch(vsymbols, diag)
+    dgf = _lambdify_batch(vsymbols, sympy.Matrix([sympy.diff(B[i, i], vsymbols[i]) for i in range(n)]))
+    params = tuple(params)
+
+    def increment(state, h, dW):
+        args = tuple(state.T) + params
+        g = gf(*args)[:, :, 0]
+        return state + h * muf(*args)[:, :, 0] + g * dW + 0.5 * g * dgf(*args)[:, :, 0] * (dW ** 2 - h)
+
+    return _euler_maruyama_steps(xstart, ystart, xfinish, nsteps, increment, n, reps, rng, positivity)
+
+
+def RosslerSRA(xstart, ystart, xfinish, nsteps, mu, B, params, vsymbols, reps=None, rng=None, positivity=None):
+    """
+    Roessler's SRA1 stochastic Runge-Kutta scheme (strong order 1.5) for models with additive noise,
+    i.e. a diffusion matrix `B` which does not depend on the state. Besides the Wiener increments
+    dW it draws the iterated integrals I_(1,0) = h/2 (dW + dV/sqrt(3)), dV independent of dW.
+    A. Roessler, Runge-Kutta methods for the strong approximation of solutions of stochastic
+    differential equations, SIAM J. Numer. Anal. 48 (2010).
+    Arguments and return values are those of `EulerMaruyamaMatrix`.
+    """
+    n, m = B.shape
+    if set().union(*[B[i, j].free_symbols for i in range(n) for j in range(m)]) & set(vsymbols[:n]):
+        raise ValueError("RosslerSRA needs additive noise, but the diffusion matrix depends on the state")
+    muf = _lambdify_batch(vsymbols, mu)
+    Bf = _lambdify_batch(vsymbols, B)
+    params = tuple(params)
+
+    def drift(state):
+        return muf(*(tuple(state.T) + params))[:, :, 0]
+
+    def increment(state, h, dW):
+        G = Bf(*(tuple(state.T) + params))
+        dw = dW[:, :m]
+        I10 = 0.5 * h * (dw + dW[:, m:] / sqrt(3))
+        f1 = drift(state)
+        H2 = state + 0.75 * h * f1 + 1.5 * np.einsum('rij,rj->ri', G, I10) / h
+        return state + h * (f1 / 3. + 2 * drift(H2) / 3.) + np.einsum('rij,rj->ri', G, dw)
+
+    return _euler_maruyama_steps(xstart, ystart, xfinish, nsteps, increment, 2 * m, reps, rng, positivity)
+
+
+def _adaptive_steps(xstart, ystart, xfinish, increment, transitions, h0, rtol, atol, rng, positivity, max_steps,
+                    hmin=None):
+    """
+    Adaptive Euler-Maruyama stepping with step doubling. Each step of size h is compared with two
+    steps of size h/2, whose midpoint Wiener value comes from the Brownian bridge. A rejected step
+    is split at that same midpoint, and the second half is kept on a stack of future increments,
+    so the Brownian path is never resampled and the solution stays unbiased (the RSwM1 approach of
+    Rackauckas and Nie, 2017).
+    As in the fixed step solvers, the path stops at the last valid step when an accepted state is
+    negative or not finite. Raises RuntimeError when the step size falls below `hmin`, or when
+    `max_steps` accepted or rejected steps do not reach `xfinish`.
+    :param max_steps: maximum number of accepted steps, and of rejected steps
+    :param hmin: smallest step size. Defaults to 1e-12 times the interval.
+    :return: times of the accepted steps, states, number of rejected steps
+    """
+    if positivity is not None and positivity not in POSITIVITY:
+        raise ValueError("positivity must be one of {}, got {}".format(sorted(POSITIVITY), positivity))
+    g = as_streams(rng, 1)[0]
+    fix = POSITIVITY[positivity] if positivity is not None else (lambda x: x)
+    x = np.array(ystart, dtype=float).ravel()[None, :]
+    t = float(xstart)
+    h = h0 or (xfinish - xstart) / 100.
+    hmin = 1e-12 * abs(xfinish - xstart) if hmin is None else hmin
+    xvals, sol = [t], [x[0].copy()]
+    future = []  # (dt, dW) already drawn for the times after t, nearest last
+    rejected = 0
+    while t < xfinish:
+        if len(xvals) > max_steps:
+            raise RuntimeError("More than {} accepted steps before t = {}".format(max_steps, xfinish))
+        if future:
+            dt, dW = future.pop()
+        else:
+            dt = min(h, xfinish - t)
+            dW = sqrt(dt) * g.standard_normal(transitions)
+        dW1 = dW / 2 + sqrt(dt / 4) * g.standard_normal(transitions)
+        full = fix(increment(x, dt, dW[None, :]))
+        half = fix(increment(fix(increment(x, dt / 2, dW1[None, :])), dt / 2, (dW - dW1)[None, :]))
+        err = np.max(np.abs(full - half) / (atol + rtol * np.abs(half)))
+        if err > 1 or not np.isfinite(err):
+            future.append((dt / 2, dW - dW1))
+            future.append((dt / 2, dW1))
+            h = dt / 2
+            rejected += 1
+            if h < hmin:
+                raise RuntimeError("Step size too small at t = {}".format(t))
+            if rejected > max_steps:
+                raise RuntimeError("More than {} rejected steps at t = {}".format(max_steps, t))
+            continue
+        if not (np.isfinite(half).all() and (half >= 0).all()):
             break
-        args = tuple(current_state)+params
-        print(args)
-        print(mu[0, 0])
-        print(muf(*args))
-        sol[:, step] = current_state + (h * np.array(muf(*args))) + np.array(Bf(*args)) * dW
-        xvals[step, 0] = xvals[step - 1, 0] + h
-        current_state = sol[:, step]
-        print(step)
-        step += 1
-    return xvals, sol
+        t += dt
+        x = half
+        xvals.append(t)
+        sol.append(x[0].copy())
+        h = dt * min(2., 0.9 / max(err, 1e-10))
+    return np.array(xvals), np.array(sol), rejected
+
+
+def AdaptiveEulerMaruyamaMatrix(xstart, ystart, xfinish, mu, B, params, vsymbols, h0=None, rtol=1e-2, atol=1.,
+                                rng=None, positivity=None, max_steps=10 ** 6, hmin=None):
+    """
+    Adaptive-step Euler-Maruyama solver for a single path of a model in matrix form.
+    The step size is controlled by comparing each step with two half steps (see `_adaptive_steps`).
+    :param h0: initial step size. Defaults to 1/100 of the interval.
+    :param rtol: relative tolerance of the local error
+    :param atol: absolute tolerance of the local error
+    :param max_steps: maximum number of accepted steps, and of rejected steps
+    :param hmin: smallest step size. Defaults to 1e-12 times the interval.
+    :return: xvals, sol, rejected: times of the accepted steps, states of shape (len(xvals), n_states)
+     and number of rejected steps. Without `positivity`, the path stops at the last valid step if a
+     state becomes negative, as in `EulerMaruyamaMatrix`.
+    Raises RuntimeError when the step size falls below `hmin`, or after `max_steps` rejected steps,
+    or when `max_steps` accepted steps do not reach `xfinish`.
+    Other arguments are those of `EulerMaruyamaMatrix`.
+    """
+    muf = _lambdify_batch(vsymbols, mu)
+    Bf = _lambdify_batch(vsymbols, B)
+    params = tuple(params)
+
+    def increment(state, h, dW):
+        args = tuple(state.T) + params
+        return state + h * muf(*args)[:, :, 0] + np.einsum('rij,rj->ri', Bf(*args), dW)
+
+    return _adaptive_steps(xstart, ystart, xfinish, increment, B.shape[1], h0, rtol, atol, rng, positivity,
+                           max_steps, hmin)
+
+
+def AdaptiveEulerMaruyamaStoich(xstart, ystart, xfinish, props, changes, params, vsymbols, h0=None, rtol=1e-2,
+                                atol=1., rng=None, positivity=None, max_steps=10 ** 6, hmin=None):
+    """
+    Adaptive-step version of `EulerMaruyamaStoich`, for a single path.
+    Arguments and return values are those of `AdaptiveEulerMaruyamaMatrix`, with the model given as
+    in `EulerMaruyamaStoich`.
+    """
+    from scipy import sparse
+    S = sparse.csr_matrix(changes if sparse.issparse(changes) else np.array(changes, dtype=float), dtype=float)
+    params = tuple(params)
+    if callable(props):
+        def af(state):
+            return props(state, params)
+    else:
+        S = S[:props.shape[0]]
+        lf = _lambdify_batch(vsymbols, props)
+
+        def af(state):
+            return lf(*(tuple(state.T) + params))[:, :, 0]
+
+    def increment(state, h, dW):
+        a = np.maximum(af(state), 0)
+        return state + h * (a @ S) + (np.sqrt(a) * dW) @ S
+
+    return _adaptive_steps(xstart, ystart, xfinish, increment, S.shape[0], h0, rtol, atol, rng, positivity,
+                           max_steps, hmin)
 
 
 if __name__ == "__main__":
@@ -82,12 +381,13 @@ if __name__ == "__main__":
     y0 = 15
     t = np.linspace(0, 150, 500)
     y = y0 + np.exp((b - d) * t)
-    P.plot(t, y, label="exact")
+    import plotting
+    plotting.plt.plot(t, y, label="exact")
 
     det = lambda y, b, d: (b - d) * y
     stoc = lambda y, b, d: sqrt((b + d) * y)
 
     x, sol = EulerMaruyama(0, y0, 150, 500, det, stoc, (b, d))
-    P.plot(x, sol, label='em')
-    P.grid()
-    P.show()
+    plotting.plt.plot(x, sol, label='em')
+    plotting.plt.grid()
+    plotting.show()
@@ -0,0 +1,228 @@
+# -*- coding:utf-8 -*-
+u"""
+Solvers of the deterministic limit of the models in stoichiometric form,
+dx/dt = S^T a(x, params) + m(t), where a are the transition propensities, S the change matrix
+and m an optional immigration term. The right-hand side is a vectorized NumPy kernel and stiff
+methods get the analytic Jacobian S^T da/dx as a sparse matrix, so no C code is compiled.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import numpy as np
+
+
+def stoich_rhs(props, changes, params, immigration=None):
+    """
+    Right-hand side of the deterministic model
+    :param props: propensity kernel `props(x, params)`
+    :param changes: sparse change matrix, one row per transition
+    :param params: tuple of parameters
+    :param immigration: optional function of time returning the immigration into each state
+    :return: function f(t, x)
+    """
+    from scipy import sparse
+    ST = sparse.csr_matrix(changes, dtype=float).T.tocsr()
+
+    def rhs(t, x):
+        dx = ST @ props(x, params)
+        if immigration is not None:
+            dx = dx + immigration(t)
+        return dx
+    return rhs
+
+
+def drift_jacobian(jac, changes, params, dense=False):
+    """
+    Analytic Jacobian of the drift, J = S^T da/dx.
+    The sparsity pattern of J is fixed, so each evaluation only maps the derivatives of the
+    propensities onto its nonzero values with a precomputed sparse matrix.
+    :param jac: (kernel, rows, cols) as returned by `modelcache.compile_jacobian`
+    :param changes: sparse change matrix, one row per transition
+    :param params: tuple of parameters
+    :param dense: return dense arrays, as needed by LSODA
+    :return: (J, pattern): function J(t, x) returning the Jacobian, and its CSC sparsity pattern
+    """
+    from scipy import sparse
+    kernel, rows, cols = jac
+    S = sparse.coo_matrix(changes, dtype=float)
+    n = S.shape[1]
+    # Transition e = (j, k) of da/dx contributes S[j, i] * da_j/dx_k to J[i, k]
+    by_row = [[] for _ in range(S.shape[0])]
+    for j, i, v in zip(S.row, S.col, S.data):
+        by_row[j].append((i, v))
+    ci, ck, cv, ce = [], [], [], []
+    for e, (j, k) in enumerate(zip(rows, cols)):
+        for i, v in by_row[j]:
+            ci.append(i)
+            ck.append(k)
+            cv.append(v)
+            ce.append(e)
+    pattern = sparse.csc_matrix((np.ones(len(ci)), (ci, ck)), shape=(n, n))
+    pattern.sum_duplicates()
+    pattern.sort_indices()
+    pos = np.array([pattern.indptr[k] + np.searchsorted(pattern.indices[pattern.indptr[k]:pattern.indptr[k + 1]], i)
+                    for i, k in zip(ci, ck)], dtype=int)
+    M = sparse.csr_matrix((cv, (pos, ce)), shape=(pattern.nnz, len(rows)))
+
+    def J(t, x):
+        Jx = sparse.csc_matrix((M @ kernel(x, params), pattern.indices, pattern.indptr), shape=(n, n))
+        return Jx.toarray() if dense else Jx
+    return J, pattern
+
+
+def ODEStoich(xstart, ystart, xfinish, nsteps, props, changes, params, jac=None, immigration=None,
+              method='BDF', rtol=1e-6, atol=1e-6, **options):
+    """
+    Integrates the deterministic model with `scipy.integrate.solve_ivp`.
+    :param xstart: initial time
+    :param ystart: initial state
+    :param xfinish: final time
+    :param nsteps: number of intervals of the output grid between `xstart` and `xfinish`
+    :param props: propensity kernel `props(x, params)`, as returned by `modelcache.compile_model`
+    :param changes: sparse change matrix, one row per transition
+    :param params: tuple of parameters
+    :param jac: (kernel, rows, cols) as returned by `modelcache.compile_jacobian`. Without it, the
+     implicit methods approximate the Jacobian by finite differences over its sparsity pattern, found
+     with `SSASolvers.propensity_reads`.
+    :param immigration: optional function of time returning the immigration into each state
+    :param method: 'BDF', 'Radau', 'LSODA' or any explicit method of `solve_ivp`
+    :param rtol: relative tolerance
+    :param atol: absolute tolerance
+    :param options: other options of `solve_ivp`, e.g. `max_step`
+    :return: xvals, sol: times and solution of shape (nsteps + 1, nvars)
+    """
+    from scipy import sparse
+    from scipy.integrate import solve_ivp
+    S = sparse.csr_matrix(changes, dtype=float)
+    y0 = np.asarray(ystart, dtype=float).ravel()
+    if method in ('BDF', 'Radau', 'LSODA'):
+        if jac is not None:
+            options['jac'] = drift_jacobian(jac, S, params, dense=method == 'LSODA')[0]
+        elif method != 'LSODA':
+            from SSASolvers import propensity_reads
+            reads = propensity_reads(lambda r, x: props(x, r), params, S.shape[1])
+            options['jac_sparsity'] = (abs(S.T) @ sparse.csr_matrix(reads.T.astype(float))) != 0
+    res = solve_ivp(stoich_rhs(props, S, params, immigration), (xstart, xfinish), y0, method=method,
+                    t_eval=np.linspace(xstart, xfinish, nsteps + 1), rtol=rtol, atol=atol, **options)
+    if not res.success:
+        raise RuntimeError(res.message)
+    return res.t, res.y.T
+
+
+# Dormand-Prince 5(4) tableau
+_DP_C = np.array([0, 1 / 5., 3 / 10., 4 / 5., 8 / 9., 1.])
+_DP_A = [[],
+         [1 / 5.],
+         [3 / 40., 9 / 40.],
+         [44 / 45., -56 / 15., 32 / 9.],
+         [19372 / 6561., -25360 / 2187., 64448 / 6561., -212 / 729.],
+         [9017 / 3168., -355 / 33., 46732 / 5247., 49 / 176., -5103 / 18656.]]
+_DP_B = np.array([35 / 384., 0, 500 / 1113., 125 / 192., -2187 / 6784., 11 / 84.])
+# fifth minus fourth order weights, the last one for the FSAL stage f(t + h, y5)
+_DP_E = np.array([71 / 57600., 0, -71 / 16695., 71 / 1920., -17253 / 339200., 22 / 525., -1 / 40.])
+
+
+def batch_rhs(props, changes, immigration=None):
+    """
+    Right-hand side of the deterministic model for a batch of K parameter sets
+    :param props: propensity kernel `props(x, params)`, broadcasting over leading axes
+    :param changes: sparse change matrix, one row per transition
+    :param immigration: optional function of an array of times returning the immigration,
+     broadcastable to (K, nvars)
+    :return: function f(t, X, params) of times (K,), states (K, nvars) and parameters (K, nparams)
+    """
+    from scipy import sparse
+    ST = sparse.csr_matrix(changes, dtype=float).T.tocsr()
+
+    def rhs(t, X, params):
+        dX = (ST @ props(X, params).T).T
+        if immigration is not None:
+            dX = dX + immigration(t)
+        return dX
+    return rhs
+
+
+def ODEBatch(xstart, ystart, xfinish, nsteps, props, changes, params, immigration=None, method='DOPRI5',
+             rtol=1e-6, atol=1e-6, substeps=1, max_step=np.inf):
+    """
+    Integrates the deterministic model for K parameter sets at once, on a (K, nvars) state array,
+    so each stage of the integrator is a single vectorized kernel call for the whole batch.
+    'RK4' takes `substeps` fixed steps per output interval. 'DOPRI5' is the adaptive Dormand-Prince
+    5(4) pair with error control per member: each member has its own time and step size, and steps
+    are cut at the output times.
+    :param xstart: initial time
+    :param ystart: initial state, shape (nvars,) or (K, nvars)
+    :param xfinish: final time
+    :param nsteps: number of intervals of the output grid between `xstart` and `xfinish`
+    :param props: propensity kernel `props(x, params)`, as returned by `modelcache.compile_model`
+    :param changes: sparse change matrix, one row per transition
+    :param params: parameter sets, shape (K, nparams) or (nparams,)
+    :param immigration: optional function of an array of times, see `batch_rhs`
+    :param method: 'DOPRI5' or 'RK4'
+    :param rtol: relative tolerance of 'DOPRI5'
+    :param atol: absolute tolerance of 'DOPRI5'
+    :param substeps: steps per output interval of 'RK4'
+    :param max_step: largest step of 'DOPRI5'
+    :return: xvals, sol: times and solutions of shape (nsteps + 1, K, nvars)
+    """
+    f = batch_rhs(props, changes, immigration)
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    Y0 = np.atleast_2d(np.asarray(ystart, dtype=float))
+    K = max(len(params), len(Y0))
+    params = np.broadcast_to(params, (K, params.shape[1]))
+    Y = np.array(np.broadcast_to(Y0, (K, Y0.shape[1])))
+    xvals = np.linspace(xstart, xfinish, nsteps + 1)
+    sol = np.empty((nsteps + 1, K, Y.shape[1]))
+    sol[0] = Y
+    if method == 'RK4':
+        h = (xfinish - xstart) / float(nsteps * substeps)
+        t = np.full(K, float(xstart))
+        for i in range(nsteps):
+            for _ in range(substeps):
+                k1 = f(t, Y, params)
+                k2 = f(t + h / 2, Y + h / 2 * k1, params)
+                k3 = f(t + h / 2, Y + h / 2 * k2, params)
+                k4 = f(t + h, Y + h * k3, params)
+                Y = Y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+                t = t + h
+            sol[i + 1] = Y
+        return xvals, sol
+    if method != 'DOPRI5':
+        raise ValueError("Unknown method {}".format(method))
+    t = np.full(K, float(xstart))
+    h = np.full(K, min(max_step, (xfinish - xstart) / float(nsteps)))
+    nxt = np.ones(K, dtype=int)  # next output time of each member
+    k1 = f(t, Y, params)
+    hmin = 1e-12 * abs(xfinish - xstart)
+    while True:
+        idx = np.nonzero(nxt <= nsteps)[0]
+        if not idx.size:
+            break
+        ti, yi, pi = t[idx], Y[idx], params[idx]
+        horizon = xvals[nxt[idx]] - ti
+        hi = np.minimum(h[idx], horizon)
+        ks = [k1[idx]]
+        for c, a in zip(_DP_C[1:], _DP_A[1:]):
+            ks.append(f(ti + c * hi, yi + hi[:, None] * sum(w * k for w, k in zip(a, ks)), pi))
+        y5 = yi + hi[:, None] * sum(w * k for w, k in zip(_DP_B, ks))
+        k7 = f(ti + hi, y5, pi)
+        ks.append(k7)
+        err = hi[:, None] * sum(w * k for w, k in zip(_DP_E, ks))
+        scale = atol + rtol * np.maximum(np.abs(yi), np.abs(y5))
+        errn = np.sqrt(np.mean((err / scale) ** 2, axis=1))
+        with np.errstate(divide='ignore'):
+            factor = np.clip(0.9 * errn ** -0.2, 0.2, 10.)
+        ok = errn <= 1
+        acc = idx[ok]
+        t[acc] = np.where(hi[ok] == horizon[ok], xvals[nxt[acc]], ti[ok] + hi[ok])
+        Y[acc] = y5[ok]
+        k1[acc] = k7[ok]
+        arrived = acc[hi[ok] == horizon[ok]]
+        sol[nxt[arrived], arrived] = Y[arrived]
+        nxt[arrived] += 1
+        # Steps cut at an output time say nothing against the previous step size
+        hnew = hi * factor
+        hnew[ok & (hi == horizon)] = np.maximum(hnew, h[idx])[ok & (hi == horizon)]
+        h[idx] = np.minimum(hnew, max_step)
+        if np.any(h[idx] < hmin):
+            raise RuntimeError("Step size too small at t = {}".format(t[idx][h[idx] < hmin].min()))
+    return xvals, sol
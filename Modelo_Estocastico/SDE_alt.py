@@ -3,24 +3,10 @@
 """
 Version of the dengue 4 serotype model implemented for Stochpy
 """
-import stochpy
 import os
-from itertools import cycle
-import pylab as P
-import numpy as np
-from stochpy.modules import InterfaceCain
 
-def plot(t,s,l):
-    P.figure()
-    s = np.vstack(s).T
-    co = cycle(['b', 'g', 'r', 'c', 'm', 'y', 'k'])
-    sy = cycle(['o', '^', '>', '<', 's', '*', '+', '1'])
-    print(s.shape, len(t))
-    for i in range(s.shape[1]):
-        P.plot(t, s[:,i], co.next()+sy.next()+'-')
-    P.legend(l, loc=0)
-    
 if __name__=="__main__":
+    import stochpy
 # Loading the model
     smod = stochpy.SSA()
     smod.model_dir = os.getcwd()
@@ -43,5 +29,6 @@ if __name__=="__main__":
 #    series = smod.data_stochsim_grid.species_means
 #    sds = smod.data_stochsim_grid.species_standard_deviations
 #    l = smod.data_stochsim.species_labels
-#    plot(t,seriegs,l)
-#    P.show()
+#    import plotting
+#    plotting.plot_series(t, series, l)
+#    plotting.show()
@@ -2,82 +2,25 @@
 """
 Version of the dengue 4 serotype model implemented for Stochpy
 """
-import stochpy
 import os
-from itertools import cycle
-import pylab as P
 import numpy as np
-from stochpy.modules import InterfaceCain
+from serotypes import serotype_matrices
 
 
-def plot(t, s, l):
-    P.figure()
-    s = np.vstack(s).T
-    co = cycle(['b', 'g', 'r', 'c', 'm', 'y', 'k'])
-    sy = cycle(['o', '^', '>', '<', 's', '*', '+', '1'])
-    print(s.shape, len(t))
-    for i in range(s.shape[1]):
-        P.plot(t, s[:, i], co.next() + sy.next() + '-')
-    P.legend(l, loc=0)
-
 def agg_by_type(s, l):
     """
-    return series aggregated by serotype
+    return series aggregated by serotype, through the index matrix of the compartment names
+    (I21 is a DENV1 infection after DENV2, see `serotypes.serotype_matrices`)
     :param s: series
     :param l: labels
     """
-    s1 = np.zeros(s.shape[0])
-    s2 = np.zeros(s.shape[0])
-    s3 = np.zeros(s.shape[0])
-    s4 = np.zeros(s.shape[0])
-    for i, n in enumerate(l):
-        if not n.startswith('I'):
-            continue
-        if n.endswith('1'):
-            s1 += s[:, i]
-        elif n.endswith('2'):
-            s2 += s[:, i]
-        elif n.endswith('3'):
-            s3 += s[:, i]
-        elif n.endswith('4'):
-            s4 += s[:, i]
-
-
-    return s1, s2, s3, s4
-
-
-def plot_4_types(t, s, l, soma=True):
-    """
-    Plot all infectives for each serotype
-    :param t: Times
-    :param s: series
-    :param l: labels
-    """
-    # print l
-    P.figure()
-
-    s1, s2, s3, s4 = agg_by_type(s, l)
-
-    P.plot(t, s1, label=r'$I_{*1}$')
-
-    P.plot(t, s2, label=r'$I_{*2}$')
-
-    P.plot(t, s3, label=r'$I_{*3}$')
-
-    P.plot(t, s4, label=r'$I_{*4}$')
-    if soma:
-        P.plot(t, s1+s2++s3+s4, label=r'$I_{*}$')
-    P.legend(loc=0)
-    P.xlabel('time')
-    P.ylabel('individuals')
-    P.savefig('4types.png', dpi=300)
-
-def plot_xcorr(s1, s2):
-    P.figure("Cross Correlation")
-    P.xcorr(s1, s2, maxlags=50)
+    P, H = serotype_matrices(l, 4)
+    return tuple((np.asarray(s, dtype=float) @ P.T).T)
 
 
 if __name__ == "__main__":
+    import stochpy
+    import plotting
     # Loading the model
     smod = stochpy.SSA(IsInteractive=False)
     smod.model_dir = os.getcwd()
@@ -108,10 +51,9 @@ if __name__ == "__main__":
     sds = smod.data_stochsim_grid.species_standard_deviations
     l = smod.data_stochsim.species_labels
     s1, s2, s3, s4 = agg_by_type(series, l)
-    plot_4_types(t, series, l)
-    P.figure()
-    P.specgram(s1, 256, t.max()/t.size)
-    #plot_xcorr(s1, s2)
-    #    plot(t,series,l)
-    #    P.show()
+    plotting.plot_4_types(t, [s1, s2, s3, s4])
+    plotting.plot_specgram(s1, t)
+    #plotting.plot_xcorr(s1, s2)
+    #    plotting.plot_series(t, series, l)
+    #    plotting.show()
     stochpy.plt.show()
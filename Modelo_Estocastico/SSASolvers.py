@@ -0,0 +1,560 @@
+# -*- coding:utf-8 -*-
+u"""
+Exact stochastic simulation (SSA) solvers for models given by a transition matrix and
+a vectorized propensity kernel `propensity(rates, state)`, which returns the propensities
+of all transitions in a single call.
+Results follow the layout of `cgillespie.Model.getStats()`: states are sampled at the
+integer times 0, 1, ..., tmax-1 and series has shape (tmax, nvars, reps). States are written on
+the grid as the simulation runs, by a `recorder.GridRecorder`; passing one of them instead
+samples any other grid, or keeps only the mean and variance across replicates.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import numpy as np
+from streams import as_streams
+from recorder import GridRecorder
+
+
+class StoichKernel(object):
+    """
+    Adapts a kernel `kernel(x, params)` of `modelcache` or `modelgen` to the `propensity(rates, state)`
+    convention of the SSA solvers. It can be pickled whenever the kernel can, e.g. for `ensemble.run_ensemble`.
+    """
+    def __init__(self, kernel):
+        self.kernel = kernel
+
+    def __call__(self, rates, state):
+        return self.kernel(state, rates)
+
+
+def GillespieDirect(rates, inits, tmat, propensity, tmax, reps=1, rng=None, recorder=None, counter=None):
+    """
+    Gillespie's direct method.
+    :param rates: tuple of rate parameters, passed to `propensity`
+    :param inits: initial state
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param propensity: propensity kernel, `propensity(rates, state)` -> array of ntransitions propensities
+    :param tmax: simulation time
+    :param reps: number of replicates
+    :param rng: seed or per-replicate generators, see `streams.as_streams`
+    :param recorder: `GridRecorder` for `reps` replicates, which then defines the output grid.
+     Defaults to keeping the series on the times 0, 1, ..., tmax-1.
+    :param counter: `recorder.EventCounter` for `reps` replicates, counting the events as they fire
+    :return: t, series, steps: sampling times, states of shape (tmax, nvars, reps) and
+     total number of events over all replicates
+    """
+    changes = np.asarray(tmat, dtype=float).T
+    rec = recorder or GridRecorder(np.arange(tmax), changes.shape[1], reps)
+    steps = 0
+    for k, g in enumerate(as_streams(rng, reps)):
+        x = np.array(inits, dtype=float)
+        tc = 0.
+        while True:
+            a = propensity(rates, x)
+            cum = np.cumsum(a)
+            a0 = cum[-1]
+            tau = g.exponential(1. / a0) if a0 > 0 else np.inf
+            if rec.hold(k, x, tc + tau):
+                break
+            j = np.searchsorted(cum, g.random() * a0, side='right')
+            x += changes[j]
+            tc += tau
+            if counter is not None:
+                counter.add(k, tc, j)
+            steps += 1
+    return rec.grid, rec.series, steps
+
+
+class ScalarKernel(object):
+    """
+    Adapts a scalar kernel `kernel(rates, state, out)`, as used by `GillespieDirectJIT`, to the
+    `propensity(rates, state)` convention of the other solvers.
+    :param kernel: scalar kernel
+    :param ntrans: number of transitions
+    """
+    def __init__(self, kernel, ntrans):
+        self.kernel = kernel
+        self.ntrans = ntrans
+
+    def __call__(self, rates, state):
+        out = np.empty(self.ntrans)
+        self.kernel(np.asarray(rates, dtype=float), np.asarray(state, dtype=float), out)
+        return out
+
+
+def _direct_events(propensity, rates, x, changes, a, tc, tn, until, g, fired):
+    """
+    Event loop of `GillespieDirectJIT`, compiled by numba. Fires the events of the direct method
+    up to time `until`, updating the state `x` and its propensities `a` in place.
+    :param tc: time of the last event
+    :param tn: time of the pending event, drawn with the propensities `a`
+    :param fired: number of events of each transition, incremented in place
+    :return: times of the last and of the pending event, number of events fired
+    """
+    ntrans = a.shape[0]
+    steps = 0
+    while tn <= until:
+        a0 = 0.
+        for j in range(ntrans):
+            a0 += a[j]
+        u = g.random() * a0
+        j = 0
+        cum = a[0]
+        while cum <= u and j < ntrans - 1:
+            j += 1
+            cum += a[j]
+        for i in range(x.shape[0]):
+            x[i] += changes[j, i]
+        fired[j] += 1
+        tc = tn
+        steps += 1
+        propensity(rates, x, a)
+        a0 = 0.
+        for j in range(ntrans):
+            a0 += a[j]
+        tn = tc + g.exponential(1. / a0) if a0 > 0 else np.inf
+    return tc, tn, steps
+
+
+_COMPILED = {}
+
+
+def _jit(f, cache=False):
+    """
+    numba's nopython compilation of `f`, done once per process. Returns None without numba.
+    :param cache: also cache the machine code on disk, next to the source of `f`
+    """
+    if f not in _COMPILED:
+        try:
+            import numba
+        except ImportError:
+            return None
+        _COMPILED[f] = numba.njit(cache=cache)(f)
+    return _COMPILED[f]
+
+
+def GillespieDirectJIT(rates, inits, tmat, propensity, tmax, reps=1, rng=None, recorder=None, counter=None):
+    """
+    Gillespie's direct method with the event loop compiled by numba. Events are fired in compiled code,
+    searching the cumulative sum of the propensities, which are evaluated by a scalar kernel also
+    compiled in nopython mode; the loop only returns to Python to write the state on the output grid,
+    and with a `counter` at the edges of its bins, to add the events tallied by the loop.
+    Draws from the streams in the same order as `GillespieDirect`, which it falls back to when
+    numba is not installed.
+    :param rates: tuple of rate parameters, passed to `propensity`
+    :param inits: initial state
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param propensity: scalar kernel, `propensity(rates, state, out)` writing the ntransitions
+     propensities into `out`, e.g. from `modelcache.compile_scalar_kernel`. It must compile in nopython mode.
+    :param tmax: simulation time
+    :param reps: number of replicates
+    :param rng: seed or per-replicate generators, see `streams.as_streams`
+    :param recorder: `GridRecorder` for `reps` replicates, which then defines the output grid.
+     Defaults to keeping the series on the times 0, 1, ..., tmax-1.
+    :param counter: `recorder.EventCounter` for `reps` replicates, counting the events as in `GillespieDirect`
+    :return: t, series, steps: sampling times, states of shape (tmax, nvars, reps) and
+     total number of events over all replicates
+    """
+    changes = np.ascontiguousarray(np.asarray(tmat, dtype=float).T)
+    propensity = getattr(propensity, 'function', propensity)
+    events = _jit(_direct_events)
+    kernel = _jit(propensity, cache=getattr(propensity, '__module__', '__main__') != '__main__')
+    if events is None:
+        return GillespieDirect(rates, inits, tmat, ScalarKernel(propensity, changes.shape[0]), tmax, reps, rng,
+                               recorder, counter)
+    rates = np.asarray(rates, dtype=float)
+    rec = recorder or GridRecorder(np.arange(tmax), changes.shape[1], reps)
+    a = np.empty(changes.shape[0])
+    fired = np.zeros(changes.shape[0], dtype=np.int64)
+    steps = 0
+    for k, g in enumerate(as_streams(rng, reps)):
+        x = np.array(inits, dtype=float)
+        kernel(rates, x, a)
+        a0 = a.sum()
+        tc = 0.
+        tn = g.exponential(1. / a0) if a0 > 0 else np.inf
+        while not rec.hold(k, x, tn):
+            until = rec.next_time(k)
+            if counter is not None:
+                # stop at the next bin edge too, so all the events of a call fall in the bin of `tn`
+                start = tn
+                i = np.searchsorted(counter.grid, start, side='right')
+                until = min(until, counter.grid[i] if i < counter.grid.size else np.inf)
+            tc, tn, n = events(kernel, rates, x, changes, a, tc, tn, until, g, fired)
+            steps += n
+            if counter is not None:
+                counter.add_counts(k, start, fired)
+                fired[:] = 0
+    return rec.grid, rec.series, steps
+
+
+def propensity_reads(propensity, rates, nvars, tol=1e-12):
+    """
+    Finds the state variables read by each propensity, by perturbing one variable at a time
+    around a generic positive state.
+    :param propensity: propensity kernel, or list of propensity functions `f(rates, state)`
+    :param rates: tuple of rate parameters
+    :param nvars: number of state variables
+    :return: boolean array of shape (nvars, ntransitions), True where transition j reads variable i
+    """
+    evaluate = propensity if callable(propensity) else (lambda r, x: np.array([f(r, x) for f in propensity]))
+    x0 = np.random.default_rng(0).uniform(10, 20, nvars)
+    a0 = np.asarray(evaluate(rates, x0), dtype=float)
+    reads = np.zeros((nvars, a0.size), dtype=bool)
+    for i in range(nvars):
+        x1 = x0.copy()
+        x1[i] *= 1.37
+        reads[i] = np.abs(np.asarray(evaluate(rates, x1), dtype=float) - a0) > tol * (1 + np.abs(a0))
+    return reads
+
+
+def dependency_graph(tmat, reads):
+    """
+    Reaction dependency graph: the transitions whose propensities change when transition j fires.
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param reads: boolean array (nvars, ntransitions) of the variables read by each propensity
+    :return: list with, for each transition j, the sorted array of dependent transitions (always including j)
+    """
+    tm = np.asarray(tmat) != 0
+    deps = []
+    for j in range(tm.shape[1]):
+        d = np.nonzero(reads[tm[:, j]].any(axis=0))[0]
+        deps.append(np.union1d(d, [j]))
+    return deps
+
+
+class IndexedPriorityQueue(object):
+    """
+    Binary heap of the putative firing times of the reactions, which keeps the position of
+    every reaction in the heap so that a single firing time can be updated in O(log M).
+    """
+    def __init__(self, times):
+        self.times = list(times)
+        self.heap = sorted(range(len(self.times)), key=self.times.__getitem__)
+        self.pos = [0] * len(self.heap)
+        for i, j in enumerate(self.heap):
+            self.pos[j] = i
+
+    def top(self):
+        """
+        :return: reaction with the smallest firing time and that time
+        """
+        j = self.heap[0]
+        return j, self.times[j]
+
+    def _swap(self, i, k):
+        heap, pos = self.heap, self.pos
+        heap[i], heap[k] = heap[k], heap[i]
+        pos[heap[i]] = i
+        pos[heap[k]] = k
+
+    def update(self, j, t):
+        """
+        Sets the firing time of reaction `j` to `t` and restores the heap order
+        """
+        times, heap = self.times, self.heap
+        times[j] = t
+        i = self.pos[j]
+        while i > 0 and times[heap[(i - 1) // 2]] > t:
+            self._swap(i, (i - 1) // 2)
+            i = (i - 1) // 2
+        n = len(heap)
+        while True:
+            c = 2 * i + 1
+            if c >= n:
+                break
+            if c + 1 < n and times[heap[c + 1]] < times[heap[c]]:
+                c += 1
+            if times[heap[c]] >= t:
+                break
+            self._swap(i, c)
+            i = c
+
+
+def GillespieNextReaction(rates, inits, tmat, propensity, tmax, reps=1, rng=None, reads=None, recorder=None,
+                          counter=None):
+    """
+    Gibson and Bruck's next reaction method.
+    Firing times are kept in an indexed priority queue and, after each event, only the reactions
+    depending on the species it changed have their propensities and firing times updated.
+    :param rates: tuple of rate parameters
+    :param inits: initial state
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param propensity: list of propensity functions `f(rates, state)`, of which only the affected ones
+     are evaluated after each event, e.g. from `modelgen.SerotypeModel.compile_functions`, or a propensity
+     kernel `propensity(rates, state)`, which evaluates all the propensities at every event
+    :param tmax: simulation time
+    :param reps: number of replicates
+    :param rng: seed or per-replicate generators, see `streams.as_streams`
+    :param reads: boolean array (nvars, ntransitions) of the state variables read by each propensity.
+     Found with `propensity_reads` if not given.
+    :param recorder: `GridRecorder` receiving the states, as in `GillespieDirect`
+    :param counter: `recorder.EventCounter` counting the events, as in `GillespieDirect`
+    :return: t, series, steps, as in `GillespieDirect`
+    """
+    tm = np.asarray(tmat)
+    changes = tm.astype(float).T
+    nvars, ntrans = tm.shape
+    if reads is None:
+        reads = propensity_reads(propensity, rates, nvars)
+    deps = dependency_graph(tm, reads)
+    if callable(propensity):
+        def affected(x, j):
+            return propensity(rates, x)[deps[j]]
+    else:
+        dep_functions = [[propensity[k] for k in d] for d in deps]
+
+        def affected(x, j):
+            return np.array([f(rates, x) for f in dep_functions[j]], dtype=float)
+    rec = recorder or GridRecorder(np.arange(tmax), nvars, reps)
+    steps = 0
+    for r, g in enumerate(as_streams(rng, reps)):
+        x = np.array(inits, dtype=float)
+        a = np.asarray(propensity(rates, x) if callable(propensity) else [f(rates, x) for f in propensity],
+                       dtype=float)
+        with np.errstate(divide='ignore'):
+            queue = IndexedPriorityQueue(np.where(a > 0, g.exponential(size=ntrans) / a, np.inf))
+        while True:
+            j, tc = queue.top()
+            if rec.hold(r, x, tc):
+                break
+            x += changes[j]
+            steps += 1
+            if counter is not None:
+                counter.add(r, tc, j)
+            new = affected(x, j)
+            for k, ak in zip(deps[j], new):
+                if ak <= 0:
+                    t_k = np.inf
+                elif k != j and a[k] > 0:
+                    t_k = tc + (a[k] / ak) * (queue.times[k] - tc)
+                else:
+                    t_k = tc + g.exponential() / ak
+                a[k] = ak
+                queue.update(k, t_k)
+    return rec.grid, rec.series, steps
+
+
+def _choose(a, u):
+    """
+    Reaction fired in each row of the propensities `a`, for uniform numbers `u` in [0, 1), as in the direct method
+    """
+    cum = np.cumsum(a, axis=1)
+    return np.minimum((cum <= u[:, None] * cum[:, -1:]).sum(axis=1), a.shape[1] - 1)
+
+
+def TauLeaping(rates, inits, tmat, propensity, tmax, reps=1, rng=None, eps=0.03, nc=10, ssa_factor=10., order=2,
+               recorder=None, counter=None):
+    """
+    Adaptive explicit tau-leaping with the step size selection of Cao, Gillespie and Petzold (2006),
+    advancing all replicates together.
+    Reactions which can exhaust one of their reactants in fewer than `nc` firings are critical:
+    at most one of them fires per leap, chosen as in the direct method. The leap is chosen so the
+    expected relative change of every reactant is bounded by `eps`; when it would be shorter than
+    `ssa_factor` mean SSA steps, that replicate takes an exact SSA step instead. Leaps producing
+    negative populations are rejected and retried with half the step. Step selection, reaction choice
+    and updates are array operations over the replicates; only the random draws are made one replicate
+    at a time, since each replicate draws from its own stream.
+    The ItoSDE model can be used with `tmat=changes.T` and `propensity=StoichKernel(propensities)`.
+    :param rates: tuple of rate parameters
+    :param inits: initial state
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param propensity: propensity kernel `propensity(rates, state)`, evaluated on (reps, nvars) blocks
+    :param tmax: simulation time
+    :param reps: number of replicates
+    :param rng: seed or per-replicate generators, see `streams.as_streams`
+    :param eps: error control parameter, bound on the relative change of the propensities in a leap
+    :param nc: critical reaction threshold
+    :param ssa_factor: use exact SSA steps when the leap is shorter than `ssa_factor / a0`
+    :param order: highest order of the reactions consuming each species, scalar or array of nvars
+    :param recorder: `GridRecorder` receiving the states, as in `GillespieDirect`. Leaps stop at its grid points.
+    :param counter: `recorder.EventCounter` counting the events, as in `GillespieDirect`. Leaps are
+     counted in the bin where they start, so the counter should share the grid of the recorder.
+    :return: t, series, steps, as in `GillespieDirect`, steps counting SSA events and leaps
+    """
+    tm = np.asarray(tmat, dtype=float)
+    V = tm.T
+    nvars, ntrans = tm.shape
+    reactant = V < 0
+    # Reactants of each reaction, padded by repeating the first one; reactions without any get a
+    # pseudo-species of infinite population
+    nr = reactant.sum(axis=1)
+    ri = np.full((ntrans, max(nr.max(), 1)), nvars)
+    rc = np.ones(ri.shape)
+    for j in range(ntrans):
+        sp = np.nonzero(reactant[j])[0]
+        if sp.size:
+            ri[j], rc[j] = np.resize(sp, ri.shape[1]), np.resize(-V[j, sp], ri.shape[1])
+    g = np.broadcast_to(np.asarray(order, dtype=float), (nvars,))
+    gens = as_streams(rng, reps)
+    rec = recorder or GridRecorder(np.arange(tmax), nvars, reps)
+    X = np.tile(np.array(inits, dtype=float), (reps, 1))
+    tc = np.zeros(reps)
+    for r in range(reps):
+        rec.hold(r, X[r], np.nextafter(0., 1.))
+    shrink = np.ones(reps)
+    steps = 0
+    while True:
+        idx = np.nonzero(rec.filled < len(rec.grid))[0]
+        if not idx.size:
+            break
+        x = X[idx]
+        a = np.maximum(np.asarray(propensity(rates, x), dtype=float).reshape(idx.size, ntrans), 0)
+        a0 = a.sum(axis=1)
+        tnext = rec.grid[rec.filled[idx]]  # next grid point to be recorded
+        horizon = tnext - tc[idx]
+        # Critical reactions and the Cao-Gillespie-Petzold leap for the non-critical ones
+        xp = np.concatenate([x, np.full((idx.size, 1), np.inf)], axis=1)
+        L = np.floor(xp[:, ri] / rc).min(axis=2)
+        crit = (a > 0) & (L < nc)
+        anc = np.where(crit, 0, a)
+        mu = anc @ V
+        s2 = anc @ V ** 2
+        bound = np.maximum(eps * x / g, 1)
+        species = (anc > 0).astype(float) @ reactant > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau1 = np.where(species, np.minimum(bound / np.abs(mu), bound ** 2 / s2), np.inf).min(axis=1)
+            tau1 *= shrink[idx]
+            ssa = tau1 < ssa_factor / a0
+        dead = a0 <= 0
+        for n in np.nonzero(dead)[0]:
+            rec.finish(idx[n], x[n])  # nothing can happen any more
+        live = ~dead
+        idx, x, a, a0, crit, anc, tau1, ssa, tnext, horizon = (
+            v[live] for v in (idx, x, a, a0, crit, anc, tau1, ssa, tnext, horizon))
+        # Each replicate draws from its own stream, so only the draws loop over the replicates
+        u = np.array([gens[r].random(2) for r in idx]).reshape(idx.size, 2)
+        e = -np.log1p(-u[:, 0])  # standard exponential
+        # Exact SSA steps
+        n = np.nonzero(ssa)[0]
+        tau = e[n] / a0[n]
+        over = tau > horizon[n]
+        for k in n[over]:
+            tc[idx[k]] = tnext[k]
+            rec.hold(idx[k], x[k], np.nextafter(tnext[k], np.inf))
+        n, tau = n[~over], tau[~over]
+        j = _choose(a[n], u[n, 1])
+        X[idx[n]] += V[j]
+        tc[idx[n]] += tau
+        steps += n.size
+        if counter is not None:
+            for k, jk in zip(n, j):
+                counter.add(idx[k], tc[idx[k]], jk)
+        # Leaps, firing at most one critical reaction
+        n = np.nonzero(~ssa)[0]
+        ac = np.where(crit[n], a[n], 0)
+        a0c = ac.sum(axis=1)
+        with np.errstate(divide='ignore'):
+            tau2 = np.where(a0c > 0, e[n] / a0c, np.inf)
+        tau = np.minimum(np.minimum(tau1[n], tau2), horizon[n])
+        lam = anc[n] * tau[:, None]
+        firings = np.array([gens[idx[k]].poisson(l) for k, l in zip(n, lam)]).reshape(n.size, ntrans)
+        fires = np.nonzero(tau2 <= np.minimum(tau1[n], horizon[n]))[0]
+        firings[fires, _choose(ac[fires], u[n[fires], 1])] += 1
+        new = x[n] + firings @ V
+        bad = (new < 0).any(axis=1)
+        shrink[idx[n[bad]]] *= 0.5
+        n, tau, firings, new = n[~bad], tau[~bad], firings[~bad], new[~bad]
+        r = idx[n]
+        shrink[r] = 1.
+        X[r] = new
+        steps += n.size
+        if counter is not None:
+            for rk, f in zip(r, firings):
+                counter.add_counts(rk, tc[rk], f)
+        reach = tau == horizon[n]
+        tc[r] = np.where(reach, tnext[n], tc[r] + tau)
+        for k in np.nonzero(reach)[0]:
+            rec.hold(r[k], new[k], np.nextafter(tc[r[k]], np.inf))
+    return rec.grid, rec.series, steps
+
+
+def HybridSSA(rates, inits, tmat, propensity, tmax, reps=1, rng=None, amin=10., xmin=100., dt=0.1, eps=0.03,
+              langevin=False, recorder=None, counter=None):
+    """
+    Hybrid simulation splitting the transitions into fast ones, integrated as a continuous process,
+    and slow ones, simulated exactly (Haseltine and Rawlings, 2002; Salis and Kaznessis, 2005).
+    A transition is fast while its propensity is at least `amin` and every compartment it changes
+    holds at least `xmin` individuals. The partition is recomputed at every step, so transitions
+    move between the subsets as the epidemic evolves: infections of a serotype still invading
+    (few infected) are simulated event by event, while those of an established epidemic are integrated.
+    Slow events are placed by integrating their total propensity until it reaches an exponential
+    random threshold, and steps are cut at them and at the grid points. The integration steps are
+    also bounded so the fast transitions change no compartment by more than a fraction `eps`, as in
+    `TauLeaping`. Compartments changed by fast transitions hold non-integer values. All replicates are advanced together.
+    :param rates: tuple of rate parameters
+    :param inits: initial state
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param propensity: propensity kernel `propensity(rates, state)`, evaluated on (reps, nvars) blocks
+    :param tmax: simulation time
+    :param reps: number of replicates
+    :param rng: seed or per-replicate generators, see `streams.as_streams`
+    :param amin: smallest propensity of a fast transition
+    :param xmin: smallest population of the compartments changed by a fast transition
+    :param dt: largest integration step of the fast transitions
+    :param eps: largest relative change of a compartment in an integration step
+    :param langevin: integrate the fast transitions as the chemical Langevin equation instead of the
+     deterministic rate equations
+    :param recorder: `GridRecorder` receiving the states, as in `GillespieDirect`
+    :param counter: `recorder.EventCounter` counting the events, as in `GillespieDirect`. Fast
+     transitions add their integrated firings of each step, in the bin where the step starts.
+    :return: t, series, steps, as in `GillespieDirect`, steps counting slow events and integration steps
+    """
+    V = np.asarray(tmat, dtype=float).T
+    nvars, ntrans = V.shape[1], V.shape[0]
+    changed = V != 0
+    gens = as_streams(rng, reps)
+    rec = recorder or GridRecorder(np.arange(tmax), nvars, reps)
+    X = np.tile(np.array(inits, dtype=float), (reps, 1))
+    tc = np.zeros(reps)
+    hazard = np.array([g.exponential() for g in gens])  # remaining integrated propensity before the next slow event
+    for r in range(reps):
+        rec.hold(r, X[r], np.nextafter(0., 1.))
+    steps = 0
+    while True:
+        idx = np.nonzero(rec.filled < len(rec.grid))[0]
+        if not idx.size:
+            break
+        x = X[idx]
+        a = np.maximum(np.asarray(propensity(rates, x), dtype=float).reshape(idx.size, ntrans), 0)
+        smallest = np.where(changed, x[:, None, :], np.inf).min(axis=2)
+        fast = (a >= amin) & (smallest >= xmin)
+        af = np.where(fast, a, 0)
+        aslow = a - af
+        a0s = aslow.sum(axis=1)
+        tnext = rec.grid[rec.filled[idx]]
+        horizon = tnext - tc[idx]
+        drift = af @ V
+        with np.errstate(divide='ignore'):
+            tslow = np.where(a0s > 0, hazard[idx] / a0s, np.inf)
+            tfast = (np.maximum(eps * x, 1) / np.abs(drift)).min(axis=1)
+        h = np.minimum(np.minimum(np.minimum(dt, tfast), horizon), tslow)
+        fired = af * h[:, None]
+        if langevin:
+            z = np.array([gens[r].standard_normal(ntrans) for r in idx])
+            fired += np.sqrt(fired) * z
+        x = np.maximum(x + fired @ V, 0)
+        hazard[idx] -= a0s * h
+        steps += idx.size
+        for n, r in enumerate(idx):
+            if not np.any(a[n] > 0):
+                # Nothing can happen any more
+                rec.finish(r, x[n])
+                continue
+            if counter is not None:
+                counter.add_counts(r, tc[r], np.maximum(fired[n], 0))
+            if h[n] == tslow[n]:
+                cum = np.cumsum(aslow[n])
+                j = np.searchsorted(cum, gens[r].random() * cum[-1], side='right')
+                x[n] += V[j]
+                hazard[r] = gens[r].exponential()
+                steps += 1
+                if counter is not None:
+                    counter.add(r, tc[r] + h[n], j)
+            if h[n] == horizon[n]:
+                tc[r] = tnext[n]
+                rec.hold(r, x[n], np.nextafter(tc[r], np.inf))
+            else:
+                tc[r] += h[n]
+        X[idx] = x
+    return rec.grid, rec.series, steps
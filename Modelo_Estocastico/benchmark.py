@@ -0,0 +1,353 @@
+# -*- coding:utf-8 -*-
+u"""
+Benchmark of the solvers of the 4 serotype model.
+Every solver simulates the same model (`modelgen.SerotypeModel`), from the same initial state, up
+to the same horizon and with fixed seeds, for each population size N and number of replicates.
+It reports the wall time, the number of events or steps per second, the peak resident memory
+and the error of the ensemble mean against a reference ensemble, and saves them as JSON so runs
+can be compared with `--compare`. Each case runs in a fresh process, so peak memory is its own.
+Solvers whose dependencies are not installed are reported as skipped.
+`--check-imports` checks instead that the solver modules import fast and without plotting
+code or sympy, and exits with an error otherwise.
+
+    python benchmark.py --sizes 500 5000 --reps 1 10 --output bench.json
+    python benchmark.py --check-imports
+
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+#: modules run by the solvers and their worker processes, which must import quickly
+CORE_MODULES = ('streams', 'recorder', 'SSASolvers', 'ITOSolvers', 'ODESolvers', 'ensemble', 'trajstore', 'sweep',
+                'kernels', 'serotypes')
+#: modules which the core modules must not load
+HEAVY_MODULES = ('matplotlib', 'pylab', 'sympy', 'scipy', 'stochpy')
+
+R0 = 2.  # basic reproduction number of each serotype
+INFECTED = 0.001  # initial fraction infected by each serotype
+
+
+def scenario(N, serotypes=4):
+    """
+    Model, parameters and initial state of the benchmark for a population of size `N`
+    :return: (model, params, inits)
+    """
+    from modelgen import SerotypeModel
+    model = SerotypeModel(serotypes)
+    sigma, mu = 1 / 1.5, 1 / (70 * 52.)
+    params = (N, R0 * (sigma + mu) / N, 0.2, mu, sigma)
+    inits = np.zeros(len(model.vnames))
+    i0 = max(1, int(round(INFECTED * N)))
+    for s in range(serotypes):
+        inits[model.vnames.index('I_{}'.format(s + 1))] = i0
+    inits[0] = N - serotypes * i0
+    return model, params, inits
+
+
+class CountingKernel(object):
+    """
+    Propensity kernel counting its evaluations, as the cost measure of the ODE solvers
+    """
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.calls = 0
+
+    def __call__(self, x, params):
+        self.calls += 1
+        return self.kernel(x, params)
+
+
+def _ssa(solver, **options):
+    def compile(model, params, inits):
+        from SSASolvers import StoichKernel
+        return model.tmat, StoichKernel(model.compile()[0])
+
+    def run(compiled, params, inits, tmax, reps, seed):
+        import SSASolvers
+        tmat, propensity = compiled
+        return getattr(SSASolvers, solver)(params, inits, tmat, propensity, tmax, reps=reps, rng=seed, **options)
+    return compile, run
+
+
+def _next_reaction_compile(model, params, inits):
+    from SSASolvers import propensity_reads
+    functions = model.compile_functions()
+    return model.tmat, functions, propensity_reads(functions, params, len(inits))
+
+
+def _next_reaction(compiled, params, inits, tmax, reps, seed):
+    from SSASolvers import GillespieNextReaction
+    tmat, functions, reads = compiled
+    return GillespieNextReaction(params, inits, tmat, functions, tmax, reps=reps, rng=seed, reads=reads)
+
+
+def _direct_jit_compile(model, params, inits):
+    from SSASolvers import GillespieDirectJIT
+    kernel = model.compile_scalar()
+    GillespieDirectJIT(params, inits, model.tmat, kernel, 1)  # numba compiles the loop on the first call
+    return model.tmat, kernel
+
+
+def _direct_jit(compiled, params, inits, tmax, reps, seed):
+    from SSASolvers import GillespieDirectJIT
+    tmat, kernel = compiled
+    return GillespieDirectJIT(params, inits, tmat, kernel, tmax, reps=reps, rng=seed)
+
+
+def _stoich_compile(model, params, inits):
+    return model.compile()
+
+
+def _euler_maruyama(substeps):
+    def run(compiled, params, inits, tmax, reps, seed):
+        from ITOSolvers import EulerMaruyamaStoich
+        kernel, S = compiled
+        nsteps = (tmax - 1) * substeps
+        xvals, sol = EulerMaruyamaStoich(0, inits, tmax - 1, nsteps, kernel, S, params, None, reps=reps, rng=seed,
+                                         positivity='clip')
+        return xvals[::substeps], np.moveaxis(sol[::substeps], 1, 2), nsteps * reps
+    return run
+
+
+def _ode(method):
+    def compile(model, params, inits):
+        kernel, S = model.compile()
+        return kernel, S, model.jacobian() if method in ('BDF', 'Radau', 'LSODA') else None
+
+    def run(compiled, params, inits, tmax, reps, seed):
+        from ODESolvers import ODEStoich
+        kernel, S, jac = compiled
+        counted = CountingKernel(kernel)
+        t, sol = ODEStoich(0, inits, tmax - 1, tmax - 1, counted, S, params, jac=jac, method=method)
+        return t, sol[:, :, None], counted.calls
+    return compile, run
+
+
+def _cgillespie_compile(model, params, inits):
+    import sympy
+    funcs = [sympy.lambdify(model.vsymbols, p, 'math') for p in model.propensities()]
+    return model.vnames, model.tmat, [lambda r, x, f=f: f(*(tuple(x) + tuple(r))) for f in funcs]
+
+
+def _cgillespie(compiled, params, inits, tmax, reps, seed):
+    from ensemble import _run_batch
+    from streams import seed_sequence
+    vnames, tmat, propensity = compiled
+    t, series, rec, steps, counts = _run_batch(vnames, params, inits, tmat, propensity, tmax,
+                                               seed_sequence(seed), 0, reps)
+    return t, series, steps
+
+
+#: solvers benchmarked: name -> (modules required, compile, run). `compile(model, params, inits)`
+#: builds what the solver needs from the model, untimed, and `run(compiled, params, inits, tmax, reps, seed)`
+#: returns the times, the series of shape (tmax, nvars, reps) and the number of events or steps.
+SOLVERS = {'direct': ((),) + _ssa('GillespieDirect'),
+           'direct_jit': (('numba',), _direct_jit_compile, _direct_jit),
+           'next_reaction': ((), _next_reaction_compile, _next_reaction),
+           'tau_leaping': ((),) + _ssa('TauLeaping'),
+           'hybrid': ((),) + _ssa('HybridSSA'),
+           'cgillespie': (('cgillespie',), _cgillespie_compile, _cgillespie),
+           'euler_maruyama': ((), _stoich_compile, _euler_maruyama(10)),
+           'ode_radau': ((),) + _ode('Radau'),
+           'ode_rk45': ((),) + _ode('RK45'),
+           }
+
+
+def missing(name):
+    """
+    :return: the modules required by solver `name` which are not installed
+    """
+    return [m for m in SOLVERS[name][0] if importlib.util.find_spec(m) is None]
+
+
+def peak_rss():
+    """
+    :return: peak resident memory of the current process in MB, or None where unavailable
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2. ** 20 if sys.platform == 'darwin' else rss / 2. ** 10
+
+
+def run_case(name, N, reps, tmax, seed, serotypes=4):
+    """
+    Runs one benchmark case, in a fresh process when called through `benchmark`
+    :return: dict with the wall time, number of steps, peak RSS and ensemble mean of the run
+    """
+    model, params, inits = scenario(N, serotypes)
+    modules, compile, run = SOLVERS[name]
+    compiled = compile(model, params, inits)  # not timed
+    t0 = time.perf_counter()
+    t, series, steps = run(compiled, params, inits, tmax, reps, seed)
+    wall = time.perf_counter() - t0
+    return {'wall': wall, 'steps': int(steps), 'steps_per_sec': steps / wall if wall > 0 else None,
+            'peak_rss_mb': peak_rss(), 'mean': np.nanmean(series, axis=2)}
+
+
+def _isolated(name, N, reps, tmax, seed, serotypes):
+    """
+    Runs `run_case` in a new process
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_case, name, N, reps, tmax, seed, serotypes).result()
+
+
+def benchmark(solvers=None, sizes=(500, 5000, 50000), reps=(1, 10), tmax=20, seed=1, reference='direct',
+              ref_reps=20, serotypes=4):
+    """
+    Runs every solver for every population size and number of replicates.
+    The error of a run is the root mean square difference between its ensemble mean and the
+    mean of `ref_reps` replicates of the `reference` solver, divided by N. The reference uses a
+    different seed from the runs.
+    :param solvers: names of the solvers, keys of `SOLVERS`. Defaults to all.
+    :param sizes: population sizes N
+    :param reps: numbers of replicates
+    :param tmax: horizon, in weeks
+    :param seed: seed of the runs
+    :param reference: solver of the reference ensemble
+    :param ref_reps: number of replicates of the reference ensemble
+    :param serotypes: number of serotypes of the model
+    :return: dict with the description of the run ('meta') and one record per case ('results')
+    """
+    solvers = list(SOLVERS) if solvers is None else solvers
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'tmax': tmax, 'seed': seed,
+            'serotypes': serotypes, 'reference': reference, 'ref_reps': ref_reps}
+    results = []
+    for N in sizes:
+        ref = _isolated(reference, N, ref_reps, tmax, seed + 1, serotypes)['mean']
+        for name in solvers:
+            for r in reps:
+                record = {'solver': name, 'N': N, 'reps': r}
+                lacking = missing(name)
+                if lacking:
+                    record['skipped'] = 'missing {}'.format(', '.join(lacking))
+                    results.append(record)
+                    print('{:>15} N={:<7} reps={:<5} skipped: {}'.format(name, N, r, record['skipped']))
+                    continue
+                try:
+                    out = _isolated(name, N, r, tmax, seed, serotypes)
+                except ImportError as e:
+                    record['skipped'] = str(e)
+                    results.append(record)
+                    print('{:>15} N={:<7} reps={:<5} skipped: {}'.format(name, N, r, e))
+                    continue
+                record.update((k, v) for k, v in out.items() if k != 'mean')
+                record['error'] = float(np.sqrt(np.mean((out['mean'] - ref) ** 2)) / N)
+                results.append(record)
+                print('{:>15} N={:<7} reps={:<5} {:9.3f} s {:12.0f} steps/s {:8.1f} MB error {:.2e}'.format(
+                    name, N, r, record['wall'], record['steps_per_sec'] or 0, record['peak_rss_mb'] or 0,
+                    record['error']))
+    return {'meta': meta, 'results': results}
+
+
+def compare(old, new, tolerance=1.2):
+    """
+    Compares the wall times of two benchmark runs, case by case
+    :param old: results of the earlier run, as returned by `benchmark`
+    :param new: results of the later run
+    :param tolerance: ratio of the wall times above which a case is reported as a regression
+    :return: list of (solver, N, reps, ratio of the wall times new/old) of the regressions
+    """
+    before = {(r['solver'], r['N'], r['reps']): r for r in old['results'] if 'wall' in r}
+    regressions = []
+    for r in new['results']:
+        key = (r['solver'], r['N'], r['reps'])
+        if 'wall' in r and key in before:
+            ratio = r['wall'] / before[key]['wall']
+            if ratio > tolerance:
+                regressions.append(key + (ratio,))
+    return regressions
+
+
+def _fresh_cost(statement, heavy):
+    """
+    Runs `statement` in a fresh interpreter
+    :return: (seconds, list of the `heavy` modules it loaded)
+    """
+    code = ("import sys, time; t = time.perf_counter(); {}; t = time.perf_counter() - t; "
+            "print(t); print(','.join(m for m in {!r} if m in sys.modules))")
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.check_output([sys.executable, '-c', code.format(statement, tuple(heavy))], cwd=here,
+                                  universal_newlines=True).split('\n')
+    return float(out[0]), [h for h in out[1].split(',') if h]
+
+
+def import_costs(modules=CORE_MODULES, heavy=HEAVY_MODULES):
+    """
+    Measures the import of each module in a fresh interpreter
+    :param modules: names of the modules
+    :param heavy: names of the modules whose loading is reported
+    :return: dict module -> (seconds, list of the `heavy` modules it loaded)
+    """
+    return {m: _fresh_cost('import {}'.format(m), heavy) for m in modules}
+
+
+def unpickle_cost(path, heavy=HEAVY_MODULES):
+    """
+    Measures the unpickling of the object saved in `path` in a fresh interpreter, as done by the
+    worker processes receiving a compiled kernel
+    :return: (seconds, list of the `heavy` modules it loaded)
+    """
+    return _fresh_cost('import pickle; pickle.load(open({!r}, "rb"))'.format(os.path.abspath(path)), heavy)
+
+
+def check_imports(budget=0.5, modules=CORE_MODULES, heavy=HEAVY_MODULES):
+    """
+    Checks that each module imports in less than `budget` seconds without loading any of `heavy`
+    :return: list of messages describing the violations, empty if there are none
+    """
+    errors = []
+    for m, (seconds, loaded) in import_costs(modules, heavy).items():
+        if seconds > budget:
+            errors.append("{} takes {:.3f} s to import, more than {} s".format(m, seconds, budget))
+        if loaded:
+            errors.append("{} imports {}".format(m, ', '.join(loaded)))
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--solvers', nargs='+', choices=sorted(SOLVERS), help='solvers to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[500, 5000, 50000], help='population sizes')
+    parser.add_argument('--reps', nargs='+', type=int, default=[1, 10], help='numbers of replicates')
+    parser.add_argument('--tmax', type=int, default=20, help='horizon in weeks')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reference', default='direct', choices=sorted(SOLVERS))
+    parser.add_argument('--ref-reps', type=int, default=20)
+    parser.add_argument('--serotypes', type=int, default=4)
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of an earlier run, to report regressions against')
+    parser.add_argument('--check-imports', action='store_true',
+                        help='only check the import time and dependencies of the solver modules')
+    parser.add_argument('--import-budget', type=float, default=0.5, help='seconds allowed to import a module')
+    args = parser.parse_args()
+    if args.check_imports:
+        errors = check_imports(args.import_budget)
+        print('\n'.join(errors) or 'Imports within budget')
+        sys.exit(1 if errors else 0)
+    res = benchmark(args.solvers, args.sizes, args.reps, args.tmax, args.seed, args.reference, args.ref_reps,
+                    args.serotypes)
+    with open(args.output, 'w') as f:
+        json.dump(res, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            for solver, N, reps, ratio in compare(json.load(f), res):
+                print('Regression: {} N={} reps={} is {:.2f} times slower'.format(solver, N, reps, ratio))
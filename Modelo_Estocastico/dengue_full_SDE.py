@@ -1,13 +1,13 @@
 # coding:utf8
 from __future__ import division
-from cgillespie import Model
+from ensemble import run_ensemble
+from serotypes import serotype_matrices
+import io
+import os
 import time
 from numpy import array, genfromtxt
-import pylab as P
 import numpy as np
 
-from itertools import cycle
-
 vnames = ['S', 'I1', 'I2', 'I3', 'I4', 'R1', 'R2', 'R3', 'R4',
           'I12', 'I13', 'I14', 'I21', 'I23', 'I24', 'I31', 'I32',
             'I34', 'I41', 'I42', 'I43', 'R']
@@ -33,126 +33,130 @@ pars = (1 / 70.,  # mu
         )
         
         
-# infectives for each serotype
-inf_types = {1: [ini[1], ini[12], ini[15], ini[18]],
-             2: [ini[2], ini[9], ini[16], ini[19]],
-             3: [ini[3], ini[10], ini[13], ini[20]],
-             4: [ini[4], ini[11], ini[14], ini[17]]
+# Rate laws for each kind of transition. `r` are the rates (`pars`), `x` the state and `lamb` the
+# force of infection of each serotype; {src} and {sero} are filled with the source compartments and
+# infecting serotypes of all transitions of that kind.
+rate_laws = {'birth': 'r[0]*x.sum(axis=-1, keepdims=True)',
+             'infection': 'x[..., {src}]*lamb[..., {sero}]',
+             'reinfection': 'r[4]*r[5]*x[..., {src}]*lamb[..., {sero}]',
+             'recovery': 'r[3]*x[..., {src}]',
+             'death': 'r[0]*x[..., {src}]',
+             }
+# The same laws for a single transition, written with scalars only for the nopython kernel;
+# lamb<k> is the force of infection of serotype k.
+jit_laws = {'birth': 'r[0]*x.sum()',
+            'infection': 'x[{src}]*lamb{sero}',
+            'reinfection': 'r[4]*r[5]*x[{src}]*lamb{sero}',
+            'recovery': 'r[3]*x[{src}]',
+            'death': 'r[0]*x[{src}]',
             }
 
-# Propensity functions
-def gen_prop_functs():
-    nat_code = "def fnat(r, ini): return r[0]*sum(ini)\n"
-    mu_code = "def fmu{}(r, ini): return r[0]*max(0,ini[{}])\n"
-    inf_code = """def f{}(r, ini): return ini[0]* lamb({})\n"""
-    rec_code = """def f{}(r, ini): return r[3]*max(0,ini[{}])\n"""
-    inf2_code = """def f{}(r, ini): return r[4]*r[5]*ini[{}]*lamb({})\n"""
-
-    nt = tm.shape[1]
-    with open('propfun.py', 'w') as f:
-        f.write("import numpy as np\n\n")
-        
-        f.write("pars = {}\nini = {}\nN = {}\n\n".format(pars, ini, N))
-        f.write("# infectives for each serotype\n\n")
-        f.write("""inf_types = {1: [ini[1], ini[12], ini[15], ini[18]],
-             2: [ini[2], ini[9], ini[16], ini[19]],
-             3: [ini[3], ini[10], ini[13], ini[20]],
-             4: [ini[4], ini[11], ini[14], ini[17]]
-            }\n\n""")
-        #TODO: Fix the indexing below
-        f.write("lamb = lambda i: {}*(ini[i+1] + sum(np.array(inf_types[i+1])*{}))\n".format(pars[1], pars[2]))
-        # f.write(inf_code)
-
-        f.write("\n#Natality\n\n")
-        f.write(nat_code)
-
-        f.write("\n#Infection rates\n\n")
-        for i, n in enumerate(['S_I1', 'S_I2', 'S_I3', 'S_I4']):  # Infection rates
-            f.write(inf_code.format(n, i))
-
-        f.write("\n#Primary recovery rates\n\n")
-        for i, n in enumerate(['I1_R1', 'I2_R2', 'I3_R3', 'I4_R4']):
-            f.write(rec_code.format(n, i+1))
-
-        f.write("\n#Secondary Infection rates\n\n")
-        for i, n in enumerate(
-                ['R1_I12', 'R1_I13', 'R1_I14', 'R2_I21', 'R2_I23', 'R2_I24', 'R3_I31',
-                 'R3_I32', 'R3_I34', 'R4_I41', 'R4_I42', 'R4_I43']):
-            type_i = [1,2,3,0,2,3,0,1,3,0,1,2] #serotype number for each infection
-            f.write(inf2_code.format(n, i // 3 + 5, type_i[i]))
-
-        f.write("\n#Secondary Recovery rates\n\n")
-        for i, n in enumerate(
-                ['I12_R', 'I13_R', 'I14_R', 'I21_R', 'I23_R', 'I24_R', 'I31_R',
-                 'I32_R', 'I34_R', 'I41_R', 'I42_R', 'I43_R']):
-            f.write(rec_code.format(n, i + 9))
-
-        f.write("\n#Mortality rates\n\n")
-        for i, n in enumerate(
-                ['S', 'I1', 'I2', 'I3', 'I4', 'R1', 'R2', 'R3', 'R4', 'I12', 'I13', 'I14', 'I21', 'I23',
-                 'I24', 'I31', 'I32', 'I34', 'I41', 'I42', 'I43', 'R']):  # Mortality rates
-            f.write(mu_code.format(n, i))
-
-
-gen_prop_functs()
-from propfun import *
-
-propensity = [fnat,                             # Natality
-              fS_I1, fS_I2, fS_I3, fS_I4,       # Primary infections
-              fI1_R1, fI2_R2, fI3_R3, fI4_R4,   # primary recovery
-              fR1_I12, fR1_I13, fR1_I14,        #Secondary infections
-              fR2_I21, fR2_I23, fR2_I24,        #Secondary infections
-              fR3_I31, fR3_I32, fR3_I34,        #Secondary infections
-              fR4_I41, fR4_I42, fR4_I43,        #Secondary infections
-              fI12_R, fI13_R, fI14_R,           # Secondary recovery
-              fI21_R, fI23_R, fI24_R,           # Secondary recovery
-              fI31_R, fI32_R, fI34_R,           # Secondary recovery
-              fI41_R, fI42_R, fI43_R,           # Secondary recovery
-              fmuS,
-              fmuI1, fmuI2, fmuI3, fmuI4,
-              fmuR1, fmuR2, fmuR3, fmuR4,
-              fmuI12, fmuI13, fmuI14,
-              fmuI21, fmuI23, fmuI24,
-              fmuI31, fmuI32, fmuI34,
-              fmuI41, fmuI42, fmuI43,
-              fmuR]
-
-assert len(propensity) == tm.shape[1]
-
-M = Model(vnames=vnames, rates=pars, inits=ini, tmat=tm, propensity=propensity)
-t0 = time.time()
-M.run(tmax=1000, reps=1)
-print 'total time: {} seconds'.format(time.time() - t0)
-t, series, steps = M.getStats()
-
-ser = series.mean(axis=2)
-
-#  Calculatin prevalence by serotype
-
-p1 = sum(ser[:,i] for i, n in enumerate(vnames) if (n.startswith('I') and '1' in n))
-p2 = sum(ser[:,i] for i, n in enumerate(vnames) if (n.startswith('I') and '2' in n))
-p3 = sum(ser[:,i] for i, n in enumerate(vnames) if (n.startswith('I') and '3' in n))
-p4 = sum(ser[:,i] for i, n in enumerate(vnames) if (n.startswith('I') and '4' in n))
-# print evts
-co = cycle(['b', 'g', 'r', 'c', 'm', 'y', 'k'])
-sy = cycle(['o', '^', '>', '<', 's', '*', '+', '1'])
-for s in range(ser.shape[1]):
-    P.plot(t, ser[:,s], co.next()+sy.next()+'-')
-P.legend(vnames, loc=0)
-P.figure()
-P.plot(t, p1, 'r-.', label='DENV1')
-P.plot(t, p2, 'g-*', label='DENV2')
-P.plot(t, p3, 'b-.', label='DENV3')
-P.plot(t, p4, 'y-.', label='DENV4')
-P.legend()
-P.figure()
-P.plot(t,ser.sum(axis=1), label="Total")
-P.legend()
-# P.plot(t, ser[:, 1::3], 'g-^')  # I plots
-# P.plot(t, ser[:, 2::3], 'b-o')  # R plots
-# P.legend(M.vn[0::3] + M.vn[1::3] + M.vn[2::3], loc=0)
-P.figure()
-for prop in propensity:
-    P.plot(t, [prop(pars,i) for i in ser])
-P.show()
 
+def transition_kind(j):
+    """
+    Classifies transition `j` of `tm` from its source and target compartments
+    :param j: column of `tm`
+    :return: kind of rate law, index of the source compartment, index of the infecting serotype
+    """
+    src = np.nonzero(tm[:, j] < 0)[0]
+    tgt = np.nonzero(tm[:, j] > 0)[0]
+    if not src.size:
+        return 'birth', None, None
+    if not tgt.size:
+        return 'death', int(src[0]), None
+    target = vnames[tgt[0]]
+    if not target.startswith('I'):
+        return 'recovery', int(src[0]), None
+    kind = 'infection' if vnames[src[0]] == 'S' else 'reinfection'
+    return kind, int(src[0]), int(target[-1]) - 1
+
+
+# Propensity kernel
+def gen_prop_kernel():
+    """
+    Writes `propfun.py`, when it changed, with a single vectorized propensity kernel, `propensity(r, ini)`,
+    returning the propensities of all transitions in `tm`. It is built from the rate laws above,
+    and the forces of infection of the four serotypes are computed once per call, from the state it
+    is called with and (4, nvars) indicator matrices of the infectives of each serotype.
+    It also holds `propensity_jit(r, ini, out)`, which writes them for a single state with scalar
+    expressions, so numba compiles it for `SSASolvers.GillespieDirectJIT`.
+    """
+    # infectives for each serotype: primary infections and secondary infections by that serotype
+    primary = np.zeros((4, len(vnames)), dtype=int)
+    secondary = np.zeros((4, len(vnames)), dtype=int)
+    for k in range(1, 5):
+        primary[k - 1, vnames.index('I{}'.format(k))] = 1
+        secondary[k - 1, [i for i, n in enumerate(vnames) if n.startswith('I') and len(n) == 3 and n.endswith(str(k))]] = 1
+    kinds = {}
+    transitions = []
+    for j in range(tm.shape[1]):
+        kind, src, sero = transition_kind(j)
+        cols, srcs, seros = kinds.setdefault(kind, ([], [], []))
+        cols.append(j)
+        srcs.append(src)
+        seros.append(sero)
+        transitions.append((kind, src, sero))
+
+    f = io.StringIO()
+    f.write("# Generated by dengue_full_SDE.gen_prop_kernel(), do not edit.\n")
+    f.write("import numpy as np\n\n")
+    f.write("PRIMARY = np.array({})\n".format(primary.tolist()))
+    f.write("SECONDARY = np.array({})\n\n\n".format(secondary.tolist()))
+    f.write("def propensity(r, ini):\n")
+    f.write("    x = np.maximum(np.asarray(ini, dtype=float), 0)\n")
+    f.write("    lamb = r[1]*(x @ (PRIMARY + r[2]*SECONDARY).T)\n")
+    f.write("    out = np.empty(x.shape[:-1] + ({},))\n".format(tm.shape[1]))
+    for kind, (cols, srcs, seros) in kinds.items():
+        f.write("    out[..., {}] = {}  # {}\n".format(cols, rate_laws[kind].format(src=srcs, sero=seros), kind))
+    f.write("    return out\n\n\n")
+    f.write("def propensity_jit(r, ini, out):\n")
+    f.write("    x = np.maximum(ini, 0.)\n")
+    for k in range(4):
+        f.write("    lamb{} = r[1]*({} + r[2]*({}))\n".format(
+            k, ' + '.join('x[{}]'.format(i) for i in np.nonzero(primary[k])[0]),
+            ' + '.join('x[{}]'.format(i) for i in np.nonzero(secondary[k])[0])))
+    for j, (kind, src, sero) in enumerate(transitions):
+        f.write("    out[{}] = {}  # {}\n".format(j, jit_laws[kind].format(src=src, sero=sero), kind))
+    source = f.getvalue()
+    # Only a changed kernel is written, and atomically: the worker processes of `run_ensemble` import this
+    # module too, under the spawn start method, and must never see a partial `propfun.py`
+    if os.path.exists('propfun.py'):
+        with open('propfun.py') as old:
+            if old.read() == source:
+                return
+    tmp = 'propfun.py.{}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as out:
+        out.write(source)
+    os.replace(tmp, 'propfun.py')
+
+
+gen_prop_kernel()
+from propfun import propensity, propensity_jit
+
+assert propensity(pars, ini).shape == (tm.shape[1],)
+
+if __name__ == "__main__":
+    # Replicates are spread over a process pool, one seeded stream per replicate. Only the
+    # mean and variance of the weekly states are kept, whatever the number of replicates.
+    # The event loop and the propensities are compiled by numba when it is installed.
+    reps = 1
+    t0 = time.time()
+    t, stats, steps = run_ensemble(vnames, pars, ini, tm, propensity_jit, tmax=1000, reps=reps, seed=None,
+                                   stats=True, jit=True)
+    print('total time: {} seconds'.format(time.time() - t0))
+
+    ser = stats.mean
+
+    #  Calculatin prevalence by serotype, through the index matrix of the compartments:
+    #  I21 is a DENV1 infection after DENV2, not a DENV2 one
+    p1, p2, p3, p4 = (ser @ serotype_matrices(vnames, 4)[0].T).T
+    # print evts
+    import plotting
+    plotting.plot_series(t, ser, vnames)
+    plotting.plot_series(t, [p1, p2, p3, p4], ['DENV1', 'DENV2', 'DENV3', 'DENV4'])
+    plotting.plot_series(t, ser.sum(axis=1), ["Total"], markers=False)
+    # P.plot(t, ser[:, 1::3], 'g-^')  # I plots
+    # P.plot(t, ser[:, 2::3], 'b-o')  # R plots
+    # P.legend(M.vn[0::3] + M.vn[1::3] + M.vn[2::3], loc=0)
+    plotting.plot_series(t, propensity(pars, ser), markers=False)
+    plotting.show()
@@ -0,0 +1,145 @@
+# -*- coding:utf-8 -*-
+u"""
+Parallel ensemble runner for the Gillespie (SSA) models.
+Replicates are split in batches and run on a process pool, each replicate seeded from
+its own child stream (see `streams.py`), so an ensemble is reproducible for a given seed
+whatever the number of workers.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import numpy as np
+from streams import seed_sequence, replicate_streams
+from recorder import GridRecorder, ReducedRecorder, EventCounter
+
+
+def _run_batch(vnames, rates, inits, tmat, propensity, tmax, seed, offset, n, stats=False, keep=True, reduce=None,
+               counts=None, jit=False):
+    """
+    Runs replicates `offset` to `offset + n - 1` of the ensemble in the current process.
+    A propensity kernel is simulated with `SSASolvers.GillespieDirect`, drawing from the replicates' streams.
+    A list of propensity functions is run by `cgillespie`, which draws from the global NumPy and
+    `random` generators, so both are reseeded from the replicate's stream before each run.
+    :param stats: also return a `GridRecorder` with the mean and variance of the batch
+    :param keep: return the series of the replicates
+    :param reduce: matrix W of shape (k, nvars). The replicates are recorded by a `ReducedRecorder`,
+     as the series of W x instead of the states.
+    :param counts: (grid, groups) of an `EventCounter` counting the events of the batch
+    :param jit: `propensity` is a scalar kernel, run with `SSASolvers.GillespieDirectJIT`
+    :return: t, series of shape (tmax, nvars, n) (None without `keep`), recorder (None without `stats`
+     or `reduce`), total number of steps, counter (None without `counts`)
+    """
+    def recorder(grid, keep):
+        if reduce is not None:
+            return ReducedRecorder(grid, reduce, n, keep=keep, stats=stats)
+        return GridRecorder(grid, len(inits), n, keep=keep, stats=stats)
+
+    if jit:
+        from SSASolvers import GillespieDirectJIT
+        rec = recorder(np.arange(tmax), keep)
+        counter = EventCounter(counts[0], counts[1], n) if counts is not None else None
+        t, series, steps = GillespieDirectJIT(rates, inits, tmat, propensity, tmax, reps=n,
+                                              rng=replicate_streams(seed, n, offset), recorder=rec, counter=counter)
+    elif callable(propensity):
+        from SSASolvers import GillespieDirect
+        rec = recorder(np.arange(tmax), keep)
+        counter = EventCounter(counts[0], counts[1], n) if counts is not None else None
+        t, series, steps = GillespieDirect(rates, inits, tmat, propensity, tmax, reps=n,
+                                           rng=replicate_streams(seed, n, offset), recorder=rec, counter=counter)
+    else:
+        if counts is not None:
+            raise ValueError("cgillespie does not report its events, so they can not be counted")
+        from cgillespie import Model
+        series = []
+        steps = 0
+        t = None
+        for g in replicate_streams(seed, n, offset):
+            s = g.integers(2 ** 32, size=2)
+            np.random.seed(s[0])
+            random.seed(int(s[1]))
+            M = Model(vnames=vnames, rates=rates, inits=inits, tmat=tmat, propensity=propensity)
+            M.run(tmax=tmax, reps=1)
+            t, ser, st = M.getStats()
+            series.append(np.array(ser, dtype=float))
+            steps += st
+        series = np.concatenate(series, axis=2)
+        counter = None
+        rec = recorder(t, reduce is not None)
+        if stats or reduce is not None:
+            for k in range(n):
+                for i, ti in enumerate(t):
+                    rec.hold(k, series[i, :, k], np.nextafter(ti, np.inf))
+        if reduce is not None:
+            series = rec.series
+    rec.series = None
+    return t, (series if keep else None), (rec if stats or reduce is not None else None), steps, counter
+
+
+def run_ensemble(vnames, rates, inits, tmat, propensity, tmax, reps, workers=None, seed=None, batch=None,
+                 stats=False, store=None, reduce=None, counter=None, jit=False):
+    """
+    Runs `reps` replicates of a Gillespie model on a process pool.
+    The arguments describing the model are those of `cgillespie.Model`. `propensity` is either a
+    vectorized kernel `propensity(rates, state)`, run with `SSASolvers.GillespieDirect`, or a list of
+    propensity functions, run with `cgillespie`. Both must be defined at module level so they can be pickled.
+    :param vnames: variable names
+    :param rates: tuple of rate parameters
+    :param inits: initial state
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param propensity: propensity kernel or list of propensity functions
+    :param tmax: simulation time
+    :param reps: number of replicates
+    :param workers: number of worker processes. Defaults to the number of CPUs.
+    :param seed: int or `numpy.random.SeedSequence` for the ensemble
+    :param batch: number of replicates per task. Defaults to spreading the replicates
+     evenly over four tasks per worker.
+    :param stats: keep only the running mean and variance of each time point across replicates,
+     instead of every replicate, so memory does not grow with `reps`
+    :param store: `trajstore.TrajectoryStore` to which each batch is written as soon as it finishes,
+     instead of keeping the replicates in memory
+    :param reduce: matrix W of shape (k, nvars): record only the k series W x instead of the
+     states, e.g. `serotypes.serotype_weights`, keeping the peak of each per replicate
+    :param counter: `recorder.EventCounter` for `reps` replicates, which receives the binned event
+     counts of each batch, e.g. from `modelgen.SerotypeModel.counter`. Not available with cgillespie.
+    :param jit: `propensity` is a scalar kernel `propensity(rates, state, out)`, run with the event loop
+     compiled by numba, see `SSASolvers.GillespieDirectJIT`
+    :return: t, series, steps as returned by `Model.getStats()`: series has shape
+     (tmax, nvars, reps) and steps is the total number of events over all replicates.
+     With `stats` or `reduce`, series is the `GridRecorder` (`ReducedRecorder`) of the ensemble,
+     with the `mean` and `var` with `stats` and the series of the replicates otherwise;
+     with a `store` and without them it is the store.
+    """
+    workers = workers or os.cpu_count() or 1
+    batch = batch or max(1, int(np.ceil(reps / (4. * workers))))
+    seed = seed_sequence(seed)
+    keep = store is not None or not stats
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_run_batch, vnames, rates, inits, tmat, propensity, tmax,
+                               seed, o, min(batch, reps - o), stats, keep, reduce,
+                               None if counter is None else (counter.grid, counter.groups), jit): o
+                   for o in range(0, reps, batch)}
+        for f in as_completed(futures):
+            t, series, rec, steps, counts = f.result()
+            if counter is not None:
+                counter.counts[:, :, futures[f]:futures[f] + counts.reps] = counts.counts
+            if store is not None:
+                store.write(futures[f], np.moveaxis(series, 2, 0))
+                series = None
+            results[futures[f]] = t, series, rec, steps
+    results = [results[o] for o in sorted(results)]
+    t = results[0][0]
+    steps = sum(r[3] for r in results)
+    if stats or reduce is not None:
+        series = results[0][2]
+        for r in results[1:]:
+            series.merge(r[2])
+        if keep and store is None:
+            series.series = np.concatenate([r[1] for r in results], axis=2)
+    elif store is not None:
+        series = store
+    else:
+        series = np.concatenate([r[1] for r in results], axis=2)
+    return t, series, steps
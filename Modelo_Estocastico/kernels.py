@@ -0,0 +1,70 @@
+# -*- coding:utf-8 -*-
+u"""
+Kernels generated by `modelcache`, loaded from their cache entries.
+Only the generated sources are imported, and they only need NumPy, so worker processes which
+unpickle a kernel load it from disk without paying for sympy and scipy.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import importlib.util
+
+
+def _load(key, src_path, name):
+    """
+    Object `name` of the generated module `src_path`
+    """
+    spec = importlib.util.spec_from_file_location('kernel_' + key, src_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return getattr(mod, name)
+
+
+class CachedKernel(object):
+    """
+    Kernel loaded from the cache. It pickles as a reference to its cache entry, so it can be
+    sent to worker processes, which load it again from disk.
+    """
+    def __init__(self, key, src_path, name):
+        self.key, self.src_path, self.name = key, src_path, name
+        self._kernel = _load(key, src_path, name)
+
+    def __call__(self, *args):
+        return self._kernel(*args)
+
+    @property
+    def function(self):
+        """
+        The generated function itself, e.g. to compile it with numba
+        """
+        return self._kernel
+
+    def __getstate__(self):
+        return self.key, self.src_path, self.name
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class CachedFunctions(object):
+    """
+    List of propensity functions loaded from the cache, see `modelcache.functions_source`.
+    It pickles as a reference to its cache entry, like `CachedKernel`.
+    """
+    def __init__(self, key, src_path, name):
+        self.key, self.src_path, self.name = key, src_path, name
+        self._functions = _load(key, src_path, name)
+
+    def __len__(self):
+        return len(self._functions)
+
+    def __getitem__(self, j):
+        return self._functions[j]
+
+    def __iter__(self):
+        return iter(self._functions)
+
+    def __getstate__(self):
+        return self.key, self.src_path, self.name
+
+    def __setstate__(self, state):
+        self.__init__(*state)
@@ -0,0 +1,356 @@
+# -*- coding:utf-8 -*-
+u"""
+Compilation cache for models in stoichiometric form.
+The propensity vector is turned into the source of a vectorized NumPy kernel which is
+stored on disk together with the sparse change matrix, keyed on a hash of the model.
+Later runs load both in milliseconds instead of lambdifying the sympy model again.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import os
+import hashlib
+import keyword
+import numpy as np
+import sympy
+from scipy import sparse
+from sympy.printing.lambdarepr import NumPyPrinter
+from kernels import CachedKernel, CachedFunctions
+
+CACHE_DIR = os.environ.get('STOCHD_CACHE',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.modelcache'))
+
+#: version of the generated sources, part of every cache key: bump it whenever `KERNEL_HEADER` or a
+#: source generator changes, so existing caches are not loaded with stale kernels
+CACHE_VERSION = 2
+
+KERNEL_HEADER = """# Generated by modelcache.py, do not edit.
+import numpy
+
+"""
+
+
+def _as_csr(changes):
+    """
+    Return the change matrix as a float64 CSR sparse matrix
+    :param changes: sympy Matrix, NumPy array or scipy.sparse matrix
+    """
+    if sparse.issparse(changes):
+        return sparse.csr_matrix(changes, dtype=float)
+    return sparse.csr_matrix(np.array(changes, dtype=float))
+
+
+def _hasher(kind, name, props, vsymbols, nstates=None, aux=None):
+    """
+    Hash of a cache entry, salted with `CACHE_VERSION`
+    :param kind: kind of entry, e.g. 'model' or 'jacobian'
+    :param name: name of the generated function
+    :param props: expressions
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`, if not implied by the entry
+    :param aux: auxiliary symbols used in `props`, see `kernel_source`
+    :return: `hashlib` object, to which more data can be added
+    """
+    h = hashlib.sha1('{}:{}:{}:{}'.format(CACHE_VERSION, kind, name, nstates).encode('utf8'))
+    h.update(sympy.srepr(list(props)).encode('utf8'))
+    h.update(sympy.srepr(list(vsymbols)).encode('utf8'))
+    if aux is not None:
+        h.update(sympy.srepr(list(aux[0])).encode('utf8'))
+        h.update(np.ascontiguousarray(aux[1], dtype=float).tobytes())
+    return h
+
+
+def model_key(props, changes, vsymbols, aux=None, name='propensities'):
+    """
+    Hash identifying a model.
+    :param props: sympy Matrix of transition propensities
+    :param changes: change matrix, one row per transition
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param aux: auxiliary symbols used in `props`, see `kernel_source`
+    :param name: name of the kernel function, which is part of the cached source
+    :return: hexadecimal digest
+    """
+    S = _as_csr(changes)[:len(props)]
+    h = _hasher('model', name, props, vsymbols, aux=aux)
+    h.update(np.asarray(S.shape).tobytes())
+    h.update(S.indptr.tobytes())
+    h.update(S.indices.tobytes())
+    h.update(S.data.tobytes())
+    return h.hexdigest()
+
+
+def _identifiers(symbols):
+    """
+    Symbols named as valid Python identifiers, for the generated source
+    :return: dict symbol -> renamed symbol
+    """
+    names = {}
+    for i, s in enumerate(symbols):
+        n = str(s)
+        names[s] = sympy.Symbol(n if n.isidentifier() and not keyword.iskeyword(n) else '_v{}'.format(i))
+    return names
+
+
+def _aux_sum(row, states):
+    """
+    Source of the sum of the `states` (identifiers) weighted by `row`
+    """
+    terms = ['{}{}'.format('' if c == 1 else '{!r}*'.format(c), states[k])
+             for k, c in zip(np.nonzero(row)[0], row[row != 0])]
+    return ' + '.join(terms) or '0.'
+
+
+def kernel_source(props, vsymbols, nstates, name='propensities', aux=None):
+    """
+    Generates the source of a vectorized NumPy function `name(x, params)` evaluating `props`.
+    `x` has shape (..., nstates) and `params` shape (..., len(vsymbols) - nstates); the function
+    returns a float64 array of shape (..., len(props)).
+    :param props: sympy Matrix (or list) of expressions
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`
+    :param name: name of the generated function
+    :param aux: (symbols, A): auxiliary symbols used in `props`, which the kernel computes once per
+     call as the linear combinations of the states `x @ A.T`, e.g. the forces of infection
+    :return: source code as a string
+    """
+    props = list(props)
+    asymbols = list(aux[0]) if aux is not None else []
+    names = _identifiers(list(vsymbols) + asymbols)
+    printer = NumPyPrinter()
+    snames = ', '.join(str(names[s]) for s in vsymbols[:nstates])
+    pnames = ', '.join(str(names[s]) for s in vsymbols[nstates:])
+    header = KERNEL_HEADER
+    lines = ["def {}(x, params):".format(name),
+             "    x = numpy.asarray(x, dtype=float)",
+             "    {}, = numpy.moveaxis(x, -1, 0)".format(snames)]
+    if pnames:
+        lines.append("    {}, = numpy.moveaxis(numpy.asarray(params, dtype=float), -1, 0)".format(pnames))
+    if asymbols:
+        header += "_AUX = numpy.array({})\n\n\n".format(np.asarray(aux[1], dtype=float).tolist())
+        lines.append("    {}, = numpy.moveaxis(x @ _AUX.T, -1, 0)".format(', '.join(str(names[s]) for s in asymbols)))
+    lines.append("    out = numpy.empty(x.shape[:-1] + ({},))".format(len(props)))
+    for j, expr in enumerate(props):
+        lines.append("    out[..., {}] = {}".format(j, printer.doprint(sympy.sympify(expr).xreplace(names))))
+    lines.append("    return out")
+    return header + "\n".join(lines) + "\n"
+
+
+def scalar_kernel_source(props, vsymbols, nstates, name='propensity', aux=None):
+    """
+    Generates the source of a scalar function `name(params, x, out)` writing the values of `props`
+    at the single state `x` into `out`, for `SSASolvers.GillespieDirectJIT`. It only indexes arrays
+    and does arithmetic on floats, so it compiles in numba's nopython mode, and it allocates nothing.
+    :param props: sympy Matrix (or list) of expressions
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`
+    :param name: name of the generated function
+    :param aux: (symbols, A): auxiliary symbols used in `props`, computed as the sums of the states
+     over the nonzeros of each row of A, see `kernel_source`
+    :return: source code as a string
+    """
+    props = list(props)
+    asymbols = list(aux[0]) if aux is not None else []
+    names = _identifiers(list(vsymbols) + asymbols)
+    printer = NumPyPrinter()
+    lines = ["def {}(params, x, out):".format(name)]
+    lines += ["    {} = x[{}]".format(names[s], i) for i, s in enumerate(vsymbols[:nstates])]
+    lines += ["    {} = params[{}]".format(names[s], i) for i, s in enumerate(vsymbols[nstates:])]
+    if asymbols:
+        A = np.asarray(aux[1], dtype=float)
+        for s, row in zip(asymbols, A):
+            lines.append("    {} = {}".format(names[s], _aux_sum(row, [names[v] for v in vsymbols[:nstates]])))
+    for j, expr in enumerate(props):
+        lines.append("    out[{}] = {}".format(j, printer.doprint(sympy.sympify(expr).xreplace(names))))
+    return KERNEL_HEADER + "\n".join(lines) + "\n"
+
+
+def functions_source(props, vsymbols, nstates, name='propensity', aux=None):
+    """
+    Generates the source of one scalar function per expression, `<name>_<j>(params, x)`, listed in
+    the module variable `name`. Each reads only the states and parameters its expression uses, so
+    the next reaction method can update the few propensities affected by an event.
+    :param props: sympy Matrix (or list) of expressions
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`
+    :param name: name of the list of functions
+    :param aux: (symbols, A): auxiliary symbols used in `props`, computed in the functions using
+     them as the sums of the states over the nonzeros of each row of A, see `kernel_source`
+    :return: source code as a string
+    """
+    asymbols = list(aux[0]) if aux is not None else []
+    A = np.asarray(aux[1], dtype=float) if aux is not None else None
+    names = _identifiers(list(vsymbols) + asymbols)
+    printer = NumPyPrinter()
+    index = dict((s, i) for i, s in enumerate(vsymbols))
+    functions = []
+    for j, expr in enumerate(props):
+        expr = sympy.sympify(expr)
+        used = expr.free_symbols
+        lines = ["def {}_{}(params, x):".format(name, j)]
+        needed = set(s for s in used if s in index)
+        for a, row in zip(asymbols, A if A is not None else []):
+            if a in used:
+                needed.update(vsymbols[k] for k in np.nonzero(row)[0])
+        for s in vsymbols[:nstates]:
+            if s in needed:
+                lines.append("    {} = x[{}]".format(names[s], index[s]))
+        for s in vsymbols[nstates:]:
+            if s in needed:
+                lines.append("    {} = params[{}]".format(names[s], index[s] - nstates))
+        for a, row in zip(asymbols, A if A is not None else []):
+            if a in used:
+                lines.append("    {} = {}".format(names[a], _aux_sum(row, [names[v] for v in vsymbols[:nstates]])))
+        lines.append("    return {}".format(printer.doprint(expr.xreplace(names))))
+        functions.append("\n".join(lines))
+    listing = "{} = [{}]\n".format(name, ', '.join('{}_{}'.format(name, j) for j in range(len(functions))))
+    return KERNEL_HEADER + "\n\n\n".join(functions) + "\n\n\n" + listing
+
+
+def _write_atomic(path, write):
+    """
+    Calls `write` on a temporary file and moves it over `path`, so concurrent runs never see partial entries
+    """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _source_writer(src):
+    """
+    Writer of the source `src`, for `_write_atomic`
+    """
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(src)
+    return write
+
+
+def _cache_entry(cache_dir, key, build, exts=('.py',)):
+    """
+    Makes sure the files of a cache entry exist, building them if any is missing
+    :param cache_dir: cache directory. Defaults to `CACHE_DIR`.
+    :param key: key of the entry
+    :param build: function returning a dict extension -> writer, called only when the entry is missing
+    :param exts: extensions of the files of the entry
+    :return: path of the entry, without extension
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    base = os.path.join(cache_dir, key)
+    if not all(os.path.exists(base + ext) for ext in exts):
+        os.makedirs(cache_dir, exist_ok=True)
+        writers = build()
+        for ext in sorted(writers, key=lambda e: e == '.py'):  # the source last: it marks a complete entry
+            _write_atomic(base + ext, writers[ext])
+    return base
+
+
+def load_model(key, cache_dir=None, name='propensities'):
+    """
+    Loads a compiled model from the cache.
+    :param key: model key, as returned by `model_key`
+    :param cache_dir: cache directory. Defaults to `CACHE_DIR`.
+    :param name: name of the kernel function
+    :return: (kernel, S) where S is the CSR change matrix, or None if the model is not cached
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    src_path = os.path.join(cache_dir, key + '.py')
+    S_path = os.path.join(cache_dir, key + '.npz')
+    if not (os.path.exists(src_path) and os.path.exists(S_path)):
+        return None
+    return CachedKernel(key, src_path, name), sparse.load_npz(S_path).tocsr()
+
+
+def compile_model(props, changes, vsymbols, cache_dir=None, name='propensities', aux=None):
+    """
+    Returns the NumPy propensity kernel and the sparse change matrix of a model, building
+    and caching them on the first call. The cache entry is keyed on the propensities,
+    the change matrix and the symbols, so any change to the model invalidates it.
+    :param props: sympy Matrix of transition propensities
+    :param changes: change matrix with one row per transition
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param cache_dir: cache directory. Defaults to `CACHE_DIR`.
+    :param name: name of the kernel function
+    :param aux: auxiliary symbols used in `props`, see `kernel_source`
+    :return: (kernel, S), with kernel(x, params) -> propensities and S the CSR change matrix
+    """
+    S = _as_csr(changes)[:len(props)]
+
+    def build():
+        def write_S(path):
+            with open(path, 'wb') as f:
+                sparse.save_npz(f, S)
+        return {'.npz': write_S, '.py': _source_writer(kernel_source(props, vsymbols, S.shape[1], name, aux))}
+
+    key = model_key(props, changes, vsymbols, aux, name)
+    _cache_entry(cache_dir, key, build, ('.py', '.npz'))
+    return load_model(key, cache_dir, name)
+
+
+def compile_jacobian(props, vsymbols, nstates, cache_dir=None, name='jacobian', aux=None):
+    """
+    Returns a NumPy kernel evaluating the nonzero entries of the Jacobian of the propensities with
+    respect to the state, d props[j] / d x[k], derived symbolically and cached like `compile_model`.
+    The Jacobian of the drift of a model with change matrix S is then S^T times this matrix.
+    :param props: sympy Matrix of transition propensities
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`
+    :param cache_dir: cache directory. Defaults to `CACHE_DIR`.
+    :param name: name of the kernel function
+    :param aux: auxiliary symbols used in `props`, see `kernel_source`. Their derivatives are
+     taken through the chain rule, so the entries stay written in the auxiliary symbols.
+    :return: (kernel, rows, cols), with kernel(x, params) -> array (..., nnz) of the derivatives
+     of the propensities `rows` with respect to the states `cols`
+    """
+    def build():
+        P = sympy.Matrix(list(props))
+        J = P.jacobian(list(vsymbols[:nstates]))
+        if aux is not None:
+            J += P.jacobian(list(aux[0])) * sympy.Matrix(np.asarray(aux[1]).tolist())
+        entries = [(j, k, J[j, k]) for j in range(J.rows) for k in range(J.cols) if J[j, k] != 0]
+        rows = np.array([e[0] for e in entries], dtype=int)
+        cols = np.array([e[1] for e in entries], dtype=int)
+
+        def write_idx(path):
+            with open(path, 'wb') as f:
+                np.savez(f, rows=rows, cols=cols)
+        return {'.npz': write_idx, '.py': _source_writer(kernel_source([e[2] for e in entries], vsymbols, nstates,
+                                                                        name, aux))}
+
+    key = _hasher('jacobian', name, props, vsymbols, nstates, aux).hexdigest()
+    base = _cache_entry(cache_dir, key, build, ('.py', '.npz'))
+    with np.load(base + '.npz') as idx:
+        rows, cols = idx['rows'], idx['cols']
+    return CachedKernel(key, base + '.py', name), rows, cols
+
+
+def compile_scalar_kernel(props, vsymbols, nstates, cache_dir=None, name='propensity', aux=None):
+    """
+    Returns the scalar propensity kernel of `scalar_kernel_source`, building and caching it on the first call
+    :param props: sympy Matrix of transition propensities
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`
+    :param cache_dir: cache directory. Defaults to `CACHE_DIR`.
+    :param name: name of the kernel function
+    :param aux: auxiliary symbols used in `props`, see `kernel_source`
+    :return: kernel(params, x, out), writing the propensities at the state x into out
+    """
+    key = _hasher('scalar', name, props, vsymbols, nstates, aux).hexdigest()
+    base = _cache_entry(cache_dir, key,
+                        lambda: {'.py': _source_writer(scalar_kernel_source(props, vsymbols, nstates, name, aux))})
+    return CachedKernel(key, base + '.py', name)
+
+
+def compile_functions(props, vsymbols, nstates, cache_dir=None, name='propensity', aux=None):
+    """
+    Returns the per-transition propensity functions of `functions_source`, building and caching them on the first call
+    :param props: sympy Matrix of transition propensities
+    :param vsymbols: state symbols followed by the parameter symbols
+    :param nstates: number of state variables at the start of `vsymbols`
+    :param cache_dir: cache directory. Defaults to `CACHE_DIR`.
+    :param name: name of the list of functions
+    :param aux: auxiliary symbols used in `props`, see `kernel_source`
+    :return: `CachedFunctions`, the list of the functions f(params, x) -> propensity
+    """
+    key = _hasher('functions', name, props, vsymbols, nstates, aux).hexdigest()
+    base = _cache_entry(cache_dir, key,
+                        lambda: {'.py': _source_writer(functions_source(props, vsymbols, nstates, name, aux))})
+    return CachedFunctions(key, base + '.py', name)
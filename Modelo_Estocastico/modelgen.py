@@ -0,0 +1,205 @@
+# -*- coding:utf-8 -*-
+u"""
+Combinatorial generator of the multi-serotype dengue models with cross-immunity.
+Compartments and transitions are built from the number of serotypes and the number of
+infections allowed, instead of being written out by hand. A model is a sparse change matrix
+and a rate-law table, from which the propensities of the ODE, SDE and SSA engines are built.
+Compartments are named after the infection history: I_231 is infected by DENV1 after
+recovering from DENV2 and DENV3, and R_123 has recovered from DENV1, DENV2 and DENV3.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+from itertools import combinations
+import numpy as np
+import sympy
+from scipy import sparse
+from serotypes import serotype_matrices, infection_groups, serotype_weights, serotype_recorder, serotype_summary
+
+#: parameters of the rate laws, in the order of the parameter tuple
+PARAMS = ('N', 'beta', 'delta', 'mu', 'sigma')
+
+# Rate laws for each kind of transition. {src} is the source compartment and {foi} the force of
+# infection of the serotype of the infection: the sum of the compartments infectious with it.
+RATE_LAWS = {'infection': 'beta*{src}*({foi})',
+             'reinfection': 'delta*beta*{src}*({foi})',
+             'recovery': 'sigma*{src}',
+             'birth': 'mu*N',
+             'death': 'mu*{src}',
+             }
+
+
+class SerotypeModel(object):
+    """
+    SIR model with `n` serotypes, where recovery from a serotype gives lifelong immunity against it
+    and partial (delta) protection against the others.
+    :param n: number of serotypes, at most 9
+    :param max_infections: number of infections after which hosts are immune to all serotypes and
+     move to the compartment R. Defaults to `n`, and then the last compartment is R_12...n.
+    :param sep: separator between the compartment letter and the infection history
+    :param rate_laws: rate law templates by kind of transition, defaults to `RATE_LAWS`
+    :param params: names of the parameters of the rate laws, defaults to `PARAMS`
+    """
+    def __init__(self, n=4, max_infections=None, sep='_', rate_laws=None, params=PARAMS):
+        if not 0 < n < 10:
+            raise ValueError("Compartment names support 1 to 9 serotypes, got {}".format(n))
+        self.n = n
+        self.max_infections = m = max_infections or n
+        self.rate_laws = dict(RATE_LAWS if rate_laws is None else rate_laws)
+        serotypes = [str(s + 1) for s in range(n)]
+
+        def recovered(history):
+            return 'R' + ('' if len(history) == m and m < n else sep + ''.join(sorted(history)))
+
+        def infected(history, s):
+            return 'I' + sep + ''.join(history) + s
+
+        # Compartments, one level of infection at a time
+        self.vnames = ['S']
+        self.serotype = [None]  # infecting serotype of each compartment (0-based)
+        levels = []
+        for k in range(1, m + 1):
+            inf = [(h, s) for h in combinations(serotypes, k - 1) for s in serotypes if s not in h]
+            levels.append(inf)
+            for h, s in inf:
+                self.vnames.append(infected(h, s))
+                self.serotype.append(int(s) - 1)
+            for r in sorted(set(recovered(h + (s,)) for h, s in inf), key=self._order(serotypes)):
+                self.vnames.append(r)
+                self.serotype.append(None)
+        index = {v: i for i, v in enumerate(self.vnames)}
+
+        # Transitions (kind, source, target, serotype), with None for the outside of the population
+        self.transitions = []
+        for k, inf in enumerate(levels, 1):
+            for h, s in inf:
+                src = 'S' if k == 1 else recovered(h)
+                self.transitions.append(('infection' if k == 1 else 'reinfection',
+                                         index[src], index[infected(h, s)], int(s) - 1))
+            for h, s in inf:
+                self.transitions.append(('recovery', index[infected(h, s)], index[recovered(h + (s,))], None))
+        self.transitions.append(('birth', None, index['S'], None))
+        self.transitions.extend(('death', i, None, None) for i in range(len(self.vnames)))
+
+        rows, cols, vals = [], [], []
+        for j, (kind, src, tgt, sero) in enumerate(self.transitions):
+            for i, v in ((src, -1), (tgt, 1)):
+                if i is not None:
+                    rows.append(j)
+                    cols.append(i)
+                    vals.append(v)
+        self.changes = sparse.csr_matrix((vals, (rows, cols)), shape=(len(self.transitions), len(self.vnames)))
+
+        self.symbols = sympy.symbols(self.vnames)
+        self.psymbols = sympy.symbols(params)
+        self.vsymbols = tuple(self.symbols) + tuple(self.psymbols)
+        self.fsymbols = sympy.symbols(['lambda_{}'.format(s) for s in serotypes])
+
+    @staticmethod
+    def _order(serotypes):
+        """
+        Sort key of the recovered compartments, by the serotypes they are immune to
+        """
+        return lambda name: [c for c in name if c in serotypes]
+
+    @property
+    def tmat(self):
+        """
+        Dense transition matrix of shape (nvars, ntransitions), as used by `cgillespie` and `SSASolvers`
+        """
+        return self.changes.T.toarray().astype(int)
+
+    def infectious(self, s):
+        """
+        Compartments infectious with serotype `s` (0-based)
+        """
+        return [i for i, v in enumerate(self.serotype) if v == s]
+
+    @property
+    def foi_matrix(self):
+        """
+        Indicator matrix of shape (n, nvars) of the compartments infectious with each serotype, so
+        the sums of the forces of infection are `x @ foi_matrix.T`
+        """
+        F = np.zeros((self.n, len(self.vnames)))
+        for s in range(self.n):
+            F[s, self.infectious(s)] = 1
+        return F
+
+    def recorder(self, grid, reps=1, keep=True, stats=False):
+        """
+        Recorder of the prevalence of each serotype and the population size, see `serotype_recorder`.
+        Incidence and attack rates also need the infections counted by `counter`, see `serotype_summary`.
+        """
+        return serotype_recorder(self.vnames, grid, reps, self.n, keep, stats)
+
+    def counter(self, grid, reps=1):
+        """
+        Counter of the new infections by serotype and infection order, see `infection_groups`
+        :return: (labels, `recorder.EventCounter`)
+        """
+        from recorder import EventCounter
+        labels, G = infection_groups(self.vnames, self.tmat, self.n)
+        return labels, EventCounter(grid, G, reps)
+
+    def propensities(self, foi=False):
+        """
+        Propensities of all transitions, built from the rate-law table
+        :param foi: write the infectious sums as the symbols `fsymbols`, which the compiled kernels
+         compute once per evaluation from `foi_matrix`
+        :return: sympy Matrix
+        """
+        names = dict(zip(self.vnames + [str(p) for p in self.psymbols], self.vsymbols))
+        if foi:
+            names.update((str(f), f) for f in self.fsymbols)
+            foi = [str(f) for f in self.fsymbols]
+        else:
+            foi = ['+'.join(self.vnames[i] for i in self.infectious(s)) for s in range(self.n)]
+        p = []
+        for kind, src, tgt, sero in self.transitions:
+            law = self.rate_laws[kind].format(src=None if src is None else self.vnames[src],
+                                              foi=None if sero is None else foi[sero])
+            p.append(sympy.sympify(law, locals=names))
+        return sympy.Matrix(p)
+
+    def compile(self, cache_dir=None):
+        """
+        Compiled propensity kernel and change matrix, see `modelcache.compile_model`.
+        The kernel computes the forces of infection once per call, with `foi_matrix`.
+        :return: (kernel, S), with kernel(x, params) -> propensities
+        """
+        from modelcache import compile_model
+        return compile_model(self.propensities(foi=True), self.changes, self.vsymbols, cache_dir,
+                             aux=(self.fsymbols, self.foi_matrix))
+
+    def compile_scalar(self, cache_dir=None):
+        """
+        Compiled scalar propensity kernel, for `SSASolvers.GillespieDirectJIT`, see `modelcache.compile_scalar_kernel`
+        :return: kernel(params, x, out)
+        """
+        from modelcache import compile_scalar_kernel
+        return compile_scalar_kernel(self.propensities(foi=True), self.vsymbols, len(self.vnames), cache_dir,
+                                     aux=(self.fsymbols, self.foi_matrix))
+
+    def compile_functions(self, cache_dir=None):
+        """
+        Compiled propensity function of each transition, for `SSASolvers.GillespieNextReaction`,
+        see `modelcache.compile_functions`
+        :return: list of functions f(params, x)
+        """
+        from modelcache import compile_functions
+        return compile_functions(self.propensities(foi=True), self.vsymbols, len(self.vnames), cache_dir,
+                                 aux=(self.fsymbols, self.foi_matrix))
+
+    def jacobian(self, cache_dir=None):
+        """
+        Compiled Jacobian of the propensities, see `modelcache.compile_jacobian`
+        """
+        from modelcache import compile_jacobian
+        return compile_jacobian(self.propensities(foi=True), self.vsymbols, len(self.vnames), cache_dir,
+                                aux=(self.fsymbols, self.foi_matrix))
+
+
+if __name__ == "__main__":
+    for n in range(2, 6):
+        M = SerotypeModel(n)
+        print("{} serotypes: {} compartments, {} transitions".format(n, len(M.vnames), len(M.transitions)))
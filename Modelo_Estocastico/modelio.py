@@ -0,0 +1,305 @@
+# -*- coding:utf-8 -*-
+u"""
+Readers of the model files kept in the project: PySCeS input files (.psc, used by StochPy),
+Cain XML files, Cain's flat solver input (export.txt) and the transition matrix table (tmat.csv).
+Models are read into a `ReactionModel`, i.e. a sparse change matrix and a sympy propensity
+vector, which `ReactionModel.compile` turns into the cached NumPy kernel of `modelcache`, so any
+solver can run them without importing StochPy or Cain.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import math
+import re
+import warnings
+import xml.etree.ElementTree as ET
+import numpy as np
+import sympy
+from scipy import sparse
+
+#: name of the outside of the system in .psc files
+POOL = '$pool'
+
+
+class ReactionModel(object):
+    """
+    Reaction network read from a model file.
+    :param vnames: names of the species
+    :param reactions: names of the reactions
+    :param changes: change matrix, one row per reaction
+    :param props: propensity expressions (strings or sympy), one per reaction
+    :param params: dict of the parameter values, in the order of the parameter symbols
+    :param inits: initial amount of each species
+    :param name: name of the model
+    :param events: events of the model file, which are kept but not simulated
+    """
+    def __init__(self, vnames, reactions, changes, props, params, inits, name='', events=()):
+        self.name = name
+        self.vnames = list(vnames)
+        self.reactions = list(reactions)
+        self.changes = sparse.csr_matrix(changes, dtype=float)
+        self.params = dict(params)
+        self.inits = np.asarray(inits, dtype=float)
+        self.events = list(events)
+        self.symbols = sympy.symbols(self.vnames) if self.vnames else []
+        self.psymbols = sympy.symbols(list(self.params)) if self.params else []
+        self.vsymbols = tuple(self.symbols) + tuple(self.psymbols)
+        names = dict((str(s), s) for s in self.vsymbols)
+        self.props = sympy.Matrix([sympy.sympify(p, locals=names) for p in props])
+
+    @property
+    def tmat(self):
+        """
+        Dense transition matrix of shape (nvars, nreactions), as used by `cgillespie` and `SSASolvers`
+        """
+        return self.changes.T.toarray().astype(int)
+
+    @property
+    def rates(self):
+        """
+        Tuple of the parameter values, in the order of the parameter symbols
+        """
+        return tuple(self.params.values())
+
+    def compile(self, cache_dir=None):
+        """
+        Compiled propensity kernel and change matrix, see `modelcache.compile_model`
+        :return: (kernel, S), with kernel(x, params) -> propensities
+        """
+        from modelcache import compile_model
+        return compile_model(self.props, self.changes, self.vsymbols, cache_dir)
+
+    def compile_functions(self, cache_dir=None):
+        """
+        Compiled propensity function of each transition, for `SSASolvers.GillespieNextReaction`,
+        see `modelcache.compile_functions`
+        :return: list of functions f(params, x)
+        """
+        from modelcache import compile_functions
+        return compile_functions(self.props, self.vsymbols, len(self.vnames), cache_dir)
+
+    def compile_scalar(self, cache_dir=None):
+        """
+        Compiled scalar propensity kernel, for `SSASolvers.GillespieDirectJIT`, see `modelcache.compile_scalar_kernel`
+        :return: kernel(params, x, out)
+        """
+        from modelcache import compile_scalar_kernel
+        return compile_scalar_kernel(self.props, self.vsymbols, len(self.vnames), cache_dir)
+
+
+def _evaluate(expr, values):
+    """
+    Numeric value of the expression `expr` given the values of the names defined so far
+    """
+    return float(sympy.sympify(expr, locals=dict((k, sympy.Symbol(k)) for k in values)).subs(values))
+
+
+def _strip(line):
+    """
+    Line without its comment
+    """
+    return line.split('#', 1)[0].strip()
+
+
+def _psc_side(side):
+    """
+    Species and stoichiometries of one side of a .psc reaction, e.g. '{2}A + B' -> [('A', 2.), ('B', 1.)]
+    """
+    terms = []
+    for term in side.split('+'):
+        term = term.strip()
+        m = re.match(r'^(?:\{([\d.]+)\}|([\d.]+)\s+)?\s*(\S+)$', term)
+        if not m:
+            raise ValueError("Can not read the reaction term '{}'".format(term))
+        coef = m.group(1) or m.group(2) or 1
+        if m.group(3) != POOL:
+            terms.append((m.group(3), float(coef)))
+    return terms
+
+
+def _mass_action(factor, reactants):
+    """
+    Discrete mass-action propensity, as in Cain and SBML: the factor times the number of ways of
+    choosing the reactant molecules, x(x-1)...(x-c+1)/c! for a reactant x of stoichiometry c
+    :param factor: expression of the rate constant
+    :param reactants: list of (species, stoichiometry)
+    :return: propensity expression as a string
+    """
+    terms = ['({})'.format(factor)]
+    for s, c in reactants:
+        if c != int(c) or c < 1:
+            raise ValueError("Mass action needs a positive integer stoichiometry, got {} for {}".format(c, s))
+        c = int(c)
+        if c == 1:
+            terms.append(s)
+        else:
+            terms.append('({})/{}'.format('*'.join('({} - {})'.format(s, i) if i else s for i in range(c)),
+                                          math.factorial(c)))
+    return '*'.join(terms)
+
+
+def _reaction_model(species, reactions, params, inits, name='', events=()):
+    """
+    Builds a `ReactionModel` from reactions given as (name, reactants, products, propensity), where
+    reactants and products are lists of (species, stoichiometry). Species without initial value start at zero.
+    """
+    index = dict((s, i) for i, s in enumerate(species))
+    rows, cols, vals = [], [], []
+    for j, (rname, reactants, products, prop) in enumerate(reactions):
+        for terms, sign in ((reactants, -1), (products, 1)):
+            for s, c in terms:
+                rows.append(j)
+                cols.append(index[s])
+                vals.append(sign * c)
+    changes = sparse.csr_matrix((vals, (rows, cols)), shape=(len(reactions), len(species)))
+    return ReactionModel(species, [r[0] for r in reactions], changes, [r[3] for r in reactions], params,
+                         [inits.get(s, 0.) for s in species], name, events)
+
+
+def read_psc(path):
+    """
+    Reads a PySCeS input file. Reactions are blocks of a name followed by a colon, the reaction
+    ('A + {2}B > C', with $pool for the outside) and the rate expression. Assignments 'x = value' set
+    the initial amounts of the species and the values of the parameters, and `Event:` blocks are
+    kept in `ReactionModel.events` as (name, trigger, delay, assignments) strings.
+    Reversible reactions ('=') and fixed species are not supported.
+    :param path: .psc file
+    :return: `ReactionModel`, with the species in the order of their initial values
+    """
+    with open(path) as f:
+        lines = [_strip(l) for l in f]
+    name = ''
+    reactions, values, events = [], [], []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if not line:
+            continue
+        if line.startswith('Event:'):
+            head = line[len('Event:'):].rstrip('{').split(',')
+            body = []
+            while '}' not in lines[i]:
+                body.append(lines[i])
+                i += 1
+            i += 1
+            events.append((head[0].strip(), head[1].strip(), head[2].strip(),
+                           dict((k.strip(), v.strip()) for k, v in (b.split('=', 1) for b in body if b))))
+        elif line.startswith('Modelname:'):
+            name = line.split(':', 1)[1].strip()
+        elif line.startswith(('Description:', 'Output_In_Conc:', 'Species_In_Conc:')):
+            continue
+        elif line.startswith('FIX:'):
+            raise ValueError("Fixed species are not supported: {}".format(line))
+        elif re.match(r'^\w+:$', line):
+            body = []
+            while len(body) < 2:
+                if lines[i]:
+                    body.append(lines[i])
+                i += 1
+            if '>' not in body[0]:
+                raise ValueError("Only irreversible reactions are supported: {}".format(body[0]))
+            lhs, rhs = body[0].split('>')
+            reactions.append((line[:-1], _psc_side(lhs), _psc_side(rhs), body[1].replace('^', '**')))
+        elif '=' in line:
+            k, v = line.split('=', 1)
+            values.append((k.strip(), v.strip()))
+        else:
+            raise ValueError("Can not read the line '{}' of {}".format(line, path))
+    in_reactions = []
+    for r in reactions:
+        for s, c in r[1] + r[2]:
+            if s not in in_reactions:
+                in_reactions.append(s)
+    species = [k for k, v in values if k in in_reactions]
+    species += [s for s in in_reactions if s not in species]
+    known, params, inits = {}, {}, {}
+    for k, v in values:
+        known[k] = _evaluate(v, known)
+        (inits if k in in_reactions else params)[k] = known[k]
+    return _reaction_model(species, reactions, params, inits, name, events)
+
+
+def read_cain(path, model=None):
+    """
+    Reads a model from a Cain XML file. Propensities of reactions marked as mass action are the
+    rate constant times the number of combinations of reactant molecules, as in Cain, see `_mass_action`.
+    :param path: Cain XML file
+    :param model: id of the model, defaults to the first one
+    :return: `ReactionModel`
+    """
+    root = ET.parse(path).getroot()
+    models = root.find('listOfModels').findall('model')
+    node = models[0] if model is None else [m for m in models if m.get('id') == model][0]
+    params, known = {}, {}
+    for p in node.iter('parameter'):
+        params[p.get('id')] = known[p.get('id')] = _evaluate(p.get('expression'), known)
+    species, inits = [], {}
+    for s in node.find('listOfSpecies'):
+        species.append(s.get('id'))
+        inits[s.get('id')] = _evaluate(s.get('initialAmount', '0'), known)
+
+    def refs(r, tag):
+        lst = r.find(tag)
+        return [] if lst is None else [(s.get('species'), float(s.get('stoichiometry', 1)))
+                                       for s in lst.findall('speciesReference')]
+    reactions = []
+    for r in node.find('listOfReactions'):
+        reactants = refs(r, 'listOfReactants')
+        prop = r.get('propensity')
+        if r.get('massAction') == 'true':
+            prop = _mass_action(prop, reactants)
+        reactions.append((r.get('id'), reactants, refs(r, 'listOfProducts'), prop))
+    return _reaction_model(species, reactions, params, inits, node.get('id', ''))
+
+
+def read_cain_export(path, vnames=None):
+    """
+    Reads Cain's flat solver input, as exported for its command line solvers. The file holds the
+    initial amounts, the reactants, products and propensity dependencies of each reaction, and one
+    propensity factor per reaction, so it describes mass-action kinetics only: the propensity of
+    a reaction is its factor, `c<j>` in the parameters, times the number of combinations of its
+    reactant molecules (`_mass_action`).
+    Custom rate laws are compiled into Cain's solver and are not in the file; reactions whose
+    propensity depends on other species than their reactants are reported with a warning.
+    :param path: exported solver input
+    :param vnames: names of the species. Defaults to x0, x1, ...
+    :return: `ReactionModel`
+    """
+    with open(path) as f:
+        lines = f.read().split('\n')
+    nspecies, nreactions = int(lines[1]), int(lines[2])
+    inits = [float(v) for v in lines[3].split()]
+    packed = iter(int(v) for v in lines[4].split())
+    factors = [float(v) for v in lines[5].split()]
+    vnames = list(vnames) if vnames is not None else ['x{}'.format(i) for i in range(nspecies)]
+
+    def terms():
+        return [(vnames[next(packed)], float(next(packed))) for _ in range(next(packed))]
+    reactions, custom = [], []
+    for j in range(nreactions):
+        reactants, products = terms(), terms()
+        depends = set(vnames[next(packed)] for _ in range(next(packed)))
+        if depends != set(s for s, c in reactants):
+            custom.append(j)
+        prop = _mass_action('c{}'.format(j), reactants)
+        reactions.append(('r{}'.format(j), reactants, products, prop))
+    if custom:
+        warnings.warn("Reactions {} of {} have custom propensities, which are not in the file; "
+                      "they are read as mass action".format(custom, path))
+    params = dict(('c{}'.format(j), c) for j, c in enumerate(factors))
+    return _reaction_model(vnames, reactions, params, dict(zip(vnames, inits)))
+
+
+def read_tmat(path):
+    """
+    Reads the transition matrix table (tmat.csv): a row of transition indices, a row of transition
+    names ('S=>I1') and one row per species with its change in each transition.
+    :param path: csv file
+    :return: vnames, transition names and the CSR change matrix, one row per transition
+    """
+    with open(path) as f:
+        rows = [l.rstrip('\n').split(',') for l in f if l.strip()]
+    names = rows[1][1:]
+    vnames = [r[0] for r in rows[2:]]
+    tm = np.array([[int(v) for v in r[1:len(names) + 1]] for r in rows[2:]])
+    return vnames, names, sparse.csr_matrix(tm.T, dtype=float)
@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+u"""
+Plots of the simulation results.
+This is the only module importing matplotlib. Scripts import it inside their `__main__` blocks,
+so the solvers and models, and the worker processes running them, never load plotting code.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+from itertools import cycle
+import numpy as np
+from matplotlib import pyplot as plt
+
+COLORS = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
+MARKERS = ['o', '^', '>', '<', 's', '*', '+', '1']
+
+
+def plot_series(t, s, labels=None, markers=True):
+    """
+    Plots each column of `s` against `t` in a new figure
+    :param t: times
+    :param s: series of shape (len(t), nvars), or a list of nvars series
+    :param labels: legend labels
+    :param markers: cycle through colors and markers, instead of the default line styles
+    """
+    plt.figure()
+    s = np.asarray(s)
+    if s.ndim == 2 and s.shape[0] != len(t):
+        s = s.T
+    s = s.reshape(len(t), -1)
+    co = cycle(COLORS)
+    sy = cycle(MARKERS)
+    for i in range(s.shape[1]):
+        if markers:
+            plt.plot(t, s[:, i], next(co) + next(sy) + '-')
+        else:
+            plt.plot(t, s[:, i])
+    if labels is not None:
+        plt.legend(labels, loc=0)
+
+
+def plot_4_types(t, types, soma=True, fname='4types.png'):
+    """
+    Plots the infectives of each serotype
+    :param t: times
+    :param types: list with the series of the infectives of each serotype
+    :param soma: also plot the total
+    :param fname: file name to save the figure to, or None
+    """
+    plt.figure()
+    for k, s in enumerate(types):
+        plt.plot(t, s, label=r'$I_{{*{}}}$'.format(k + 1))
+    if soma:
+        plt.plot(t, sum(types), label=r'$I_{*}$')
+    plt.legend(loc=0)
+    plt.xlabel('time')
+    plt.ylabel('individuals')
+    if fname:
+        plt.savefig(fname, dpi=300)
+
+
+def plot_xcorr(s1, s2):
+    """
+    Cross correlation of two series
+    """
+    plt.figure("Cross Correlation")
+    plt.xcorr(s1, s2, maxlags=50)
+
+
+def plot_specgram(s, t):
+    """
+    Spectrogram of a series sampled at the times `t`
+    """
+    plt.figure()
+    plt.specgram(s, 256, t.max() / t.size)
+
+
+def show():
+    """
+    Shows all figures
+    """
+    plt.show()
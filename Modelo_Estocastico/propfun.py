@@ -1,88 +1,80 @@
+# Generated by dengue_full_SDE.gen_prop_kernel(), do not edit.
 import numpy as np
 
-pars = (0.014285714285714285, 400, 1.0, 0.1, 1.0, 0.001)
-ini = (500, 50, 30, 0, 0, 0, 0, 0, 0, 0, 0, 5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-N = 500
-
-# infectives for each serotype
-
-inf_types = {1: [ini[1], ini[12], ini[15], ini[18]],
-             2: [ini[2], ini[9], ini[16], ini[19]],
-             3: [ini[3], ini[10], ini[13], ini[20]],
-             4: [ini[4], ini[11], ini[14], ini[17]]
-            }
-
-lamb = lambda i: 400*(ini[i+1] + sum(np.array(inf_types[i+1])*1.0))
-
-#Natality
-
-def fnat(r, ini): return r[0]*sum(ini)
-
-#Infection rates
-
-def fS_I1(r, ini): return ini[0]* lamb(0)
-def fS_I2(r, ini): return ini[0]* lamb(1)
-def fS_I3(r, ini): return ini[0]* lamb(2)
-def fS_I4(r, ini): return ini[0]* lamb(3)
-
-#Primary recovery rates
-
-def fI1_R1(r, ini): return r[3]*max(0,ini[1])
-def fI2_R2(r, ini): return r[3]*max(0,ini[2])
-def fI3_R3(r, ini): return r[3]*max(0,ini[3])
-def fI4_R4(r, ini): return r[3]*max(0,ini[4])
-
-#Secondary Infection rates
-
-def fR1_I12(r, ini): return r[4]*r[5]*ini[5]*lamb(1)
-def fR1_I13(r, ini): return r[4]*r[5]*ini[5]*lamb(2)
-def fR1_I14(r, ini): return r[4]*r[5]*ini[5]*lamb(3)
-def fR2_I21(r, ini): return r[4]*r[5]*ini[6]*lamb(0)
-def fR2_I23(r, ini): return r[4]*r[5]*ini[6]*lamb(2)
-def fR2_I24(r, ini): return r[4]*r[5]*ini[6]*lamb(3)
-def fR3_I31(r, ini): return r[4]*r[5]*ini[7]*lamb(0)
-def fR3_I32(r, ini): return r[4]*r[5]*ini[7]*lamb(1)
-def fR3_I34(r, ini): return r[4]*r[5]*ini[7]*lamb(3)
-def fR4_I41(r, ini): return r[4]*r[5]*ini[8]*lamb(0)
-def fR4_I42(r, ini): return r[4]*r[5]*ini[8]*lamb(1)
-def fR4_I43(r, ini): return r[4]*r[5]*ini[8]*lamb(2)
-
-#Secondary Recovery rates
-
-def fI12_R(r, ini): return r[3]*max(0,ini[9])
-def fI13_R(r, ini): return r[3]*max(0,ini[10])
-def fI14_R(r, ini): return r[3]*max(0,ini[11])
-def fI21_R(r, ini): return r[3]*max(0,ini[12])
-def fI23_R(r, ini): return r[3]*max(0,ini[13])
-def fI24_R(r, ini): return r[3]*max(0,ini[14])
-def fI31_R(r, ini): return r[3]*max(0,ini[15])
-def fI32_R(r, ini): return r[3]*max(0,ini[16])
-def fI34_R(r, ini): return r[3]*max(0,ini[17])
-def fI41_R(r, ini): return r[3]*max(0,ini[18])
-def fI42_R(r, ini): return r[3]*max(0,ini[19])
-def fI43_R(r, ini): return r[3]*max(0,ini[20])
-
-#Mortality rates
-
-def fmuS(r, ini): return r[0]*max(0,ini[0])
-def fmuI1(r, ini): return r[0]*max(0,ini[1])
-def fmuI2(r, ini): return r[0]*max(0,ini[2])
-def fmuI3(r, ini): return r[0]*max(0,ini[3])
-def fmuI4(r, ini): return r[0]*max(0,ini[4])
-def fmuR1(r, ini): return r[0]*max(0,ini[5])
-def fmuR2(r, ini): return r[0]*max(0,ini[6])
-def fmuR3(r, ini): return r[0]*max(0,ini[7])
-def fmuR4(r, ini): return r[0]*max(0,ini[8])
-def fmuI12(r, ini): return r[0]*max(0,ini[9])
-def fmuI13(r, ini): return r[0]*max(0,ini[10])
-def fmuI14(r, ini): return r[0]*max(0,ini[11])
-def fmuI21(r, ini): return r[0]*max(0,ini[12])
-def fmuI23(r, ini): return r[0]*max(0,ini[13])
-def fmuI24(r, ini): return r[0]*max(0,ini[14])
-def fmuI31(r, ini): return r[0]*max(0,ini[15])
-def fmuI32(r, ini): return r[0]*max(0,ini[16])
-def fmuI34(r, ini): return r[0]*max(0,ini[17])
-def fmuI41(r, ini): return r[0]*max(0,ini[18])
-def fmuI42(r, ini): return r[0]*max(0,ini[19])
-def fmuI43(r, ini): return r[0]*max(0,ini[20])
-def fmuR(r, ini): return r[0]*max(0,ini[21])
+PRIMARY = np.array([[0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
+SECONDARY = np.array([[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0]])
+
+
+def propensity(r, ini):
+    x = np.maximum(np.asarray(ini, dtype=float), 0)
+    lamb = r[1]*(x @ (PRIMARY + r[2]*SECONDARY).T)
+    out = np.empty(x.shape[:-1] + (55,))
+    out[..., [0]] = r[0]*x.sum(axis=-1, keepdims=True)  # birth
+    out[..., [1, 2, 3, 4]] = x[..., [0, 0, 0, 0]]*lamb[..., [0, 1, 2, 3]]  # infection
+    out[..., [5, 6, 7, 8, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32]] = r[3]*x[..., [1, 2, 3, 4, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]]  # recovery
+    out[..., [9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]] = r[4]*r[5]*x[..., [5, 5, 5, 6, 6, 6, 7, 7, 7, 8, 8, 8]]*lamb[..., [1, 2, 3, 0, 2, 3, 0, 1, 3, 0, 1, 2]]  # reinfection
+    out[..., [33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50, 51, 52, 53, 54]] = r[0]*x[..., [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21]]  # death
+    return out
+
+
+def propensity_jit(r, ini, out):
+    x = np.maximum(ini, 0.)
+    lamb0 = r[1]*(x[1] + r[2]*(x[12] + x[15] + x[18]))
+    lamb1 = r[1]*(x[2] + r[2]*(x[9] + x[16] + x[19]))
+    lamb2 = r[1]*(x[3] + r[2]*(x[10] + x[13] + x[20]))
+    lamb3 = r[1]*(x[4] + r[2]*(x[11] + x[14] + x[17]))
+    out[0] = r[0]*x.sum()  # birth
+    out[1] = x[0]*lamb0  # infection
+    out[2] = x[0]*lamb1  # infection
+    out[3] = x[0]*lamb2  # infection
+    out[4] = x[0]*lamb3  # infection
+    out[5] = r[3]*x[1]  # recovery
+    out[6] = r[3]*x[2]  # recovery
+    out[7] = r[3]*x[3]  # recovery
+    out[8] = r[3]*x[4]  # recovery
+    out[9] = r[4]*r[5]*x[5]*lamb1  # reinfection
+    out[10] = r[4]*r[5]*x[5]*lamb2  # reinfection
+    out[11] = r[4]*r[5]*x[5]*lamb3  # reinfection
+    out[12] = r[4]*r[5]*x[6]*lamb0  # reinfection
+    out[13] = r[4]*r[5]*x[6]*lamb2  # reinfection
+    out[14] = r[4]*r[5]*x[6]*lamb3  # reinfection
+    out[15] = r[4]*r[5]*x[7]*lamb0  # reinfection
+    out[16] = r[4]*r[5]*x[7]*lamb1  # reinfection
+    out[17] = r[4]*r[5]*x[7]*lamb3  # reinfection
+    out[18] = r[4]*r[5]*x[8]*lamb0  # reinfection
+    out[19] = r[4]*r[5]*x[8]*lamb1  # reinfection
+    out[20] = r[4]*r[5]*x[8]*lamb2  # reinfection
+    out[21] = r[3]*x[9]  # recovery
+    out[22] = r[3]*x[10]  # recovery
+    out[23] = r[3]*x[11]  # recovery
+    out[24] = r[3]*x[12]  # recovery
+    out[25] = r[3]*x[13]  # recovery
+    out[26] = r[3]*x[14]  # recovery
+    out[27] = r[3]*x[15]  # recovery
+    out[28] = r[3]*x[16]  # recovery
+    out[29] = r[3]*x[17]  # recovery
+    out[30] = r[3]*x[18]  # recovery
+    out[31] = r[3]*x[19]  # recovery
+    out[32] = r[3]*x[20]  # recovery
+    out[33] = r[0]*x[0]  # death
+    out[34] = r[0]*x[1]  # death
+    out[35] = r[0]*x[2]  # death
+    out[36] = r[0]*x[3]  # death
+    out[37] = r[0]*x[4]  # death
+    out[38] = r[0]*x[5]  # death
+    out[39] = r[0]*x[6]  # death
+    out[40] = r[0]*x[7]  # death
+    out[41] = r[0]*x[8]  # death
+    out[42] = r[0]*x[9]  # death
+    out[43] = r[0]*x[10]  # death
+    out[44] = r[0]*x[11]  # death
+    out[45] = r[0]*x[12]  # death
+    out[46] = r[0]*x[13]  # death
+    out[47] = r[0]*x[14]  # death
+    out[48] = r[0]*x[15]  # death
+    out[49] = r[0]*x[16]  # death
+    out[50] = r[0]*x[17]  # death
+    out[51] = r[0]*x[18]  # death
+    out[52] = r[0]*x[19]  # death
+    out[53] = r[0]*x[20]  # death
+    out[54] = r[0]*x[21]  # death
@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+u"""
+Streaming recorder of simulated trajectories on a fixed output grid.
+Solvers tell the recorder how long each state holds and it writes it onto the grid points
+it covers (last value carried forward), so events are never stored. Optionally it keeps the
+running mean and variance of every grid point across replicates (Welford's algorithm), and
+then the full series need not be kept at all.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import numpy as np
+
+
+class GridRecorder(object):
+    """
+    Records replicates of a trajectory on the times `grid`.
+    :param grid: increasing output times
+    :param nvars: number of state variables
+    :param reps: number of replicates
+    :param keep: keep the series of every replicate, of shape (len(grid), nvars, reps)
+    :param stats: keep the running mean and variance of each grid point across replicates
+    """
+    def __init__(self, grid, nvars, reps=1, keep=True, stats=False):
+        self.grid = np.asarray(grid, dtype=float)
+        self.nvars = nvars
+        self.reps = reps
+        self.filled = np.zeros(reps, dtype=int)  # number of grid points already written, per replicate
+        self.series = np.zeros((self.grid.size, nvars, reps)) if keep else None
+        self.stats = stats
+        if stats:
+            self.count = np.zeros(self.grid.size)
+            self.mean = np.zeros((self.grid.size, nvars))
+            self._m2 = np.zeros((self.grid.size, nvars))
+
+    def next_time(self, rep=0):
+        """
+        :return: first grid time not yet written for replicate `rep`, or inf if it is complete
+        """
+        i = self.filled[rep]
+        return self.grid[i] if i < self.grid.size else np.inf
+
+    def done(self, rep=0):
+        """
+        :return: True when every grid point of replicate `rep` has been written
+        """
+        return self.filled[rep] >= self.grid.size
+
+    def hold(self, rep, x, until):
+        """
+        State `x` of replicate `rep` holds until time `until` (exclusive): it is written onto all
+        remaining grid points before that time.
+        :return: True when the replicate is complete
+        """
+        i0 = self.filled[rep]
+        i1 = i0 + np.searchsorted(self.grid[i0:], until, side='left')
+        if i1 > i0:
+            if self.series is not None:
+                self.series[i0:i1, :, rep] = x
+            if self.stats:
+                n = self.count[i0:i1, None] + 1
+                delta = x - self.mean[i0:i1]
+                self.mean[i0:i1] += delta / n
+                self._m2[i0:i1] += delta * (x - self.mean[i0:i1])
+                self.count[i0:i1] += 1
+            self.filled[rep] = i1
+        return i1 >= self.grid.size
+
+    def finish(self, rep, x):
+        """
+        State `x` holds until the end of the grid
+        """
+        return self.hold(rep, x, np.inf)
+
+    @property
+    def var(self):
+        """
+        Sample variance of each grid point across the recorded replicates
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._m2 / (self.count[:, None] - 1)
+
+    def merge(self, other):
+        """
+        Combines the statistics of another recorder on the same grid, e.g. from another worker
+        (Chan et al.'s parallel update). Series are concatenated along the replicate axis.
+        """
+        if self.stats and other.stats:
+            n = self.count + other.count
+            delta = other.mean - self.mean
+            with np.errstate(invalid='ignore', divide='ignore'):
+                w = np.where(n > 0, other.count / n, 0)[:, None]
+            self.mean += delta * w
+            self._m2 += other._m2 + delta ** 2 * (self.count * w[:, 0])[:, None]
+            self.count = n
+        if self.series is not None and other.series is not None:
+            self.series = np.concatenate([self.series, other.series], axis=2)
+        self.filled = np.concatenate([self.filled, other.filled])
+        self.reps += other.reps
+        return self
+
+
+class ReducedRecorder(GridRecorder):
+    """
+    Records linear reductions y = W x of the states instead of the states themselves, e.g. the
+    prevalence of each serotype, and keeps the peak value of each reduction and the grid time of
+    the peak, per replicate, as the simulation runs. Solvers use it like a `GridRecorder`.
+    :param grid: increasing output times
+    :param weights: matrix W of shape (k, nvars)
+    :param reps: number of replicates
+    :param keep: keep the series of the reductions, of shape (len(grid), k, reps)
+    :param stats: keep the running mean and variance of the reductions across replicates
+    """
+    def __init__(self, grid, weights, reps=1, keep=True, stats=False):
+        self.weights = np.asarray(weights, dtype=float)
+        GridRecorder.__init__(self, grid, self.weights.shape[0], reps, keep, stats)
+        self.peak = np.full((reps, self.nvars), -np.inf)
+        self.peak_time = np.full((reps, self.nvars), np.nan)
+
+    def hold(self, rep, x, until):
+        if until <= self.next_time(rep):
+            return self.done(rep)  # no grid point is written, so the state is not reduced
+        i0 = self.filled[rep]
+        y = self.weights @ np.asarray(x, dtype=float)
+        done = GridRecorder.hold(self, rep, y, until)
+        if self.filled[rep] > i0:
+            higher = y > self.peak[rep]
+            self.peak[rep, higher] = y[higher]
+            self.peak_time[rep, higher] = self.grid[i0]
+        return done
+
+    def merge(self, other):
+        self.peak = np.concatenate([self.peak, other.peak])
+        self.peak_time = np.concatenate([self.peak_time, other.peak_time])
+        return GridRecorder.merge(self, other)
+
+
+class EventCounter(object):
+    """
+    Counts the transitions fired by a simulation, grouped and binned on the output grid as they
+    happen: bin i holds the events in [grid[i], grid[i+1]) and the last bin those after grid[-1].
+    Counts are integers. Continuous solvers add fractional firings, which are carried over per
+    group until they make whole events.
+    :param grid: increasing output times
+    :param groups: membership matrix of shape (ngroups, ntransitions): the events of transition j
+     count in every group g with groups[g, j] = 1
+    :param reps: number of replicates
+    :param dtype: integer type of the counts
+    """
+    def __init__(self, grid, groups, reps=1, dtype=np.int64):
+        self.grid = np.asarray(grid, dtype=float)
+        self.groups = np.asarray(groups, dtype=np.int64)
+        self.reps = reps
+        self.counts = np.zeros((self.grid.size, self.groups.shape[0], reps), dtype=dtype)
+        self._members = [np.nonzero(col)[0] for col in self.groups.T]
+        self._carry = np.zeros((self.groups.shape[0], reps))
+
+    def _bin(self, t):
+        return max(np.searchsorted(self.grid, t, side='right') - 1, 0)
+
+    def add(self, rep, t, j):
+        """
+        One event of transition `j` of replicate `rep` at time `t`
+        """
+        self.counts[self._bin(t), self._members[j], rep] += 1
+
+    def add_counts(self, rep, t, firings):
+        """
+        Events of all transitions in a step starting at time `t`, e.g. a leap
+        :param firings: number of events of each transition, integer or fractional
+        """
+        total = self._carry[:, rep] + self.groups @ firings
+        whole = np.floor(total)
+        self.counts[self._bin(t), :, rep] += whole.astype(self.counts.dtype)
+        self._carry[:, rep] = total - whole
+
+    @property
+    def cumulative(self):
+        """
+        Cumulative counts up to the end of each bin
+        """
+        return np.cumsum(self.counts, axis=0)
+
+    def merge(self, other):
+        """
+        Appends the replicates of another counter on the same grid and groups
+        """
+        self.counts = np.concatenate([self.counts, other.counts], axis=2)
+        self._carry = np.concatenate([self._carry, other._carry], axis=1)
+        self.reps += other.reps
+        return self
@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+u"""
+Serotype bookkeeping of the multi-serotype dengue models, from the compartment names alone:
+which compartments are infected with, or immune to, each serotype, and which transitions are
+new infections. Only NumPy is needed, so the simulation scripts and worker processes do not
+import sympy; the models themselves are built by `modelgen`.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import re
+import numpy as np
+
+
+def serotype_matrices(vnames, n=4):
+    """
+    Index matrices of the serotypes from the compartment names, which follow the convention of
+    `modelgen.SerotypeModel` with or without separator: the digits after I or R are the infection history
+    and, for I, the last one is the current infection (I_21 and I21 are DENV1 infections of hosts
+    recovered from DENV2). Compartments without digits (S, or an R merging all histories) are in no row.
+    :param vnames: compartment names
+    :param n: number of serotypes
+    :return: (P, H), arrays of shape (n, nvars): P[s, i] = 1 if compartment i is infected with
+     serotype s + 1, H[s, i] = 1 if its hosts have been infected with it, currently or before
+    """
+    P = np.zeros((n, len(vnames)))
+    H = np.zeros((n, len(vnames)))
+    for i, v in enumerate(vnames):
+        m = re.match(r'^([IR])_?(\d+)$', v)
+        if not m:
+            continue
+        history = [int(c) - 1 for c in m.group(2)]
+        if max(history) >= n:
+            raise ValueError("Compartment {} has a serotype above {}".format(v, n))
+        if m.group(1) == 'I':
+            P[history[-1], i] = 1
+        H[history, i] = 1
+    return P, H
+
+
+def infection_groups(vnames, tmat, n=4):
+    """
+    Groups of the infection transitions by serotype and infection order, for counting new infections
+    with `recorder.EventCounter`. Infections are the transitions into an I compartment, whose
+    name gives the serotype and the order (I_21: DENV1, secondary), see `serotype_matrices`.
+    :param vnames: compartment names
+    :param tmat: transition matrix, shape (nvars, ntransitions)
+    :param n: number of serotypes
+    :return: (labels, G): labels ('DENV1', 1), ('DENV1', 2), ... of the n * orders groups, and their
+     membership matrix of shape (len(labels), ntransitions)
+    """
+    tm = np.asarray(tmat)
+    found = []
+    for j in range(tm.shape[1]):
+        for i in np.nonzero(tm[:, j] > 0)[0]:
+            m = re.match(r'^I_?(\d+)$', vnames[i])
+            if m:
+                found.append((int(m.group(1)[-1]) - 1, len(m.group(1)), j))
+    orders = max(o for s, o, j in found) if found else 0
+    labels = [('DENV{}'.format(s + 1), o) for s in range(n) for o in range(1, orders + 1)]
+    G = np.zeros((len(labels), tm.shape[1]), dtype=int)
+    for s, o, j in found:
+        G[s * orders + o - 1, j] = 1
+    return labels, G
+
+
+def serotype_weights(vnames, n=4):
+    """
+    Reductions of the states recorded by `serotype_recorder`: the prevalence of each serotype and
+    the population size. The hosts ever infected are not a reduction of the states, since an R
+    merging all histories (`max_infections` < n) forgets them; incidence comes from the infection
+    events instead, see `serotype_summary`.
+    :return: array of shape (n + 1, nvars)
+    """
+    P = serotype_matrices(vnames, n)[0]
+    return np.vstack([P, np.ones((1, len(vnames)))])
+
+
+def serotype_recorder(vnames, grid, reps=1, n=4, keep=True, stats=False):
+    """
+    Recorder of the serotype outputs of a simulation, to pass as the `recorder` of the SSA solvers,
+    so only n + 1 series are kept instead of all compartments. See `serotype_summary`.
+    :param vnames: compartment names
+    :param grid: output times
+    :param reps: number of replicates
+    :param n: number of serotypes
+    :param keep: keep the series of every replicate
+    :param stats: keep their mean and variance across replicates
+    :return: `recorder.ReducedRecorder`
+    """
+    from recorder import ReducedRecorder
+    return ReducedRecorder(grid, serotype_weights(vnames, n), reps, keep, stats)
+
+
+def serotype_summary(rec, counter, n=4):
+    """
+    Serotype outputs of a simulation, from a recorder made by `serotype_recorder`, which kept the
+    series, and a counter of the infections on the same grid, made with `infection_groups`.
+    Incidence counts the infection events between grid points, of every order.
+    :param rec: `recorder.ReducedRecorder`
+    :param counter: `recorder.EventCounter` of the groups of `infection_groups`
+    :param n: number of serotypes
+    :return: dict with 'prevalence' (len(grid), n, reps), 'incidence' (len(grid) - 1, n, reps),
+     'attack_rate' (n, reps): infections over the simulation per host present at the first grid point,
+     'peak' and 'peak_time' (reps, n): largest prevalence of each serotype and its time
+    """
+    if not np.array_equal(counter.grid, rec.grid):
+        raise ValueError("The counter and the recorder must share the grid")
+    s = rec.series
+    c = counter.counts
+    # bin i holds the events in [grid[i], grid[i+1]); the last one those after the grid
+    incidence = c[:-1].reshape(c.shape[0] - 1, n, c.shape[1] // n, c.shape[2]).sum(axis=2)
+    return {'prevalence': s[:, :n],
+            'incidence': incidence,
+            'attack_rate': incidence.sum(axis=0) / s[0, n],
+            'peak': rec.peak[:, :n],
+            'peak_time': rec.peak_time[:, :n],
+            }
@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+u"""
+Reproducible random streams for the stochastic solvers.
+Every replicate draws from its own child of a root `numpy.random.SeedSequence`, identified
+by the replicate number, so results do not depend on how replicates are split among
+batches or worker processes.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import numpy as np
+
+#: maximum number of floats in a pre-generated block of increments
+BLOCK_SIZE = 2 ** 22
+
+
+def seed_sequence(seed=None):
+    """
+    Returns the root seed sequence for `seed`
+    :param seed: None, int, `numpy.random.SeedSequence` or `numpy.random.Generator`
+    :return: `numpy.random.SeedSequence`
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(2 ** 32, size=4))
+    return np.random.SeedSequence(seed)
+
+
+def replicate_streams(seed, reps, offset=0):
+    """
+    Independent generators for replicates `offset` to `offset + reps - 1`.
+    Replicate `i` always gets the child with spawn key `i` of the root sequence.
+    :param seed: None, int, `numpy.random.SeedSequence` or `numpy.random.Generator`
+    :param reps: number of replicates
+    :param offset: number of the first replicate
+    :return: list of `numpy.random.Generator`
+    """
+    root = seed_sequence(seed)
+    return [np.random.Generator(np.random.PCG64(
+        np.random.SeedSequence(root.entropy, spawn_key=tuple(root.spawn_key) + (offset + i,),
+                               pool_size=root.pool_size)))
+            for i in range(reps)]
+
+
+def as_streams(rng, reps):
+    """
+    Normalizes the `rng` argument of the solvers to one generator per replicate
+    :param rng: seed accepted by `seed_sequence`, or a sequence of `reps` generators
+    :param reps: number of replicates
+    :return: list of `numpy.random.Generator`
+    """
+    if isinstance(rng, (list, tuple)):
+        if len(rng) != reps:
+            raise ValueError("Expected {} generators, got {}".format(reps, len(rng)))
+        return list(rng)
+    return replicate_streams(rng, reps)
+
+
+def normal_blocks(streams, shape, nsteps):
+    """
+    Generates standard normal draws for `nsteps` steps in large blocks.
+    Each block has shape (chunk_steps, len(streams)) + shape, where column `r` comes from `streams[r]`.
+    :param streams: list of generators, one per replicate
+    :param shape: shape of the draws of a single replicate on a single step
+    :param nsteps: total number of steps needed
+    """
+    size = len(streams) * int(np.prod(shape, dtype=int))
+    chunk_steps = int(max(1, min(nsteps, BLOCK_SIZE // max(size, 1))))
+    done = 0
+    while done < nsteps:
+        n = min(chunk_steps, nsteps - done)
+        yield np.stack([g.standard_normal((n,) + tuple(shape)) for g in streams], axis=1)
+        done += n
+
+
+def increments(streams, shape, nsteps):
+    """
+    Iterates over the per-step standard normal draws of shape (len(streams),) + shape,
+    taken from the pre-generated blocks of `normal_blocks`
+    """
+    for block in normal_blocks(streams, shape, nsteps):
+        for draws in block:
+            yield draws
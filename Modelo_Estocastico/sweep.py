@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+u"""
+Parameter sweeps over full-factorial grids or Latin hypercube designs, run on a process pool.
+When a seed is given, every completed (params, seed, solver) cell is saved to disk as soon as it finishes,
+so an interrupted sweep resumes where it stopped and cells shared by different designs are not recomputed.
+Example, sweeping delta and beta of the ItoSDE model, with a module level function
+`run(params, seed)` returning an array:
+
+    design = grid_design(delta=np.linspace(0, 1, 21), beta=np.linspace(100, 800, 15))
+    points, res = run_sweep(run, ('N', 'beta', 'delta', 'mu', 'sigma'), params, design, seed=42)
+
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import os
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from streams import seed_sequence
+
+CACHE_DIR = os.environ.get('STOCHD_SWEEP_CACHE',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sweepcache'))
+
+#: names of the swept parameters, points of shape (npoints, len(names)) and the shape of a grid (None otherwise)
+Design = namedtuple('Design', 'names points shape')
+
+
+def grid_design(**values):
+    """
+    Full-factorial design.
+    :param values: values of each swept parameter, e.g. `delta=np.linspace(0, 1, 11)`
+    :return: `Design`, whose points run over the last parameter fastest
+    """
+    names = tuple(values)
+    axes = [np.asarray(values[n], dtype=float) for n in names]
+    mesh = np.meshgrid(*axes, indexing='ij')
+    return Design(names, np.stack([m.ravel() for m in mesh], axis=1), tuple(a.size for a in axes))
+
+
+def latin_hypercube(n, seed=None, **bounds):
+    """
+    Latin hypercube design: each parameter range is split into `n` strata, sampled once each.
+    :param n: number of points
+    :param seed: seed of the design
+    :param bounds: (low, high) of each swept parameter, e.g. `beta=(100, 800)`
+    :return: `Design`
+    """
+    names = tuple(bounds)
+    g = np.random.default_rng(seed_sequence(seed))
+    u = (np.stack([g.permutation(n) for _ in names], axis=1) + g.random((n, len(names)))) / n
+    low, high = np.array([bounds[k] for k in names], dtype=float).T
+    return Design(names, low + u * (high - low), None)
+
+
+def cell_key(params, seed, solver):
+    """
+    Hash identifying a sweep cell.
+    :param params: full parameter tuple
+    :param seed: `numpy.random.SeedSequence` of the cell
+    :param solver: name of the solver
+    :return: hexadecimal digest
+    """
+    h = hashlib.sha1()
+    h.update(repr((solver, [float(p) for p in params], seed.entropy, tuple(seed.spawn_key))).encode('utf8'))
+    return h.hexdigest()
+
+
+def _run_cell(run, params, seed, fname):
+    """
+    Runs one cell in a worker and saves its result to `fname`, if given, so it survives the interruption of the sweep
+    """
+    res = np.asarray(run(params, seed))
+    if fname is None:
+        return res
+    tmp = '{}.{}.tmp.npy'.format(fname[:-4], os.getpid())
+    np.save(tmp, res)
+    os.replace(tmp, fname)
+    return res
+
+
+def run_sweep(run, pnames, base, design, seed=None, workers=None, cache_dir=None, solver=None):
+    """
+    Runs `run` on every point of a design, on a process pool.
+    All cells get the same seed (common random numbers), so differences between points are
+    not blurred by sampling noise. Cells are only saved when `seed` is given: with a fresh random seed
+    they could never be found again, so such sweeps neither read nor fill the cache.
+    :param run: module level function `run(params, seed)` returning an array of the same shape for all
+     cells, where `params` is the full parameter tuple and `seed` a `numpy.random.SeedSequence`
+     which can be passed as the `rng` of the solvers
+    :param pnames: names of the entries of the parameter tuple
+    :param base: parameter tuple, supplying the values of the parameters not swept
+    :param design: `Design`, from `grid_design` or `latin_hypercube`
+    :param seed: int or `numpy.random.SeedSequence`. None draws a fresh seed and disables the cache.
+    :param workers: number of worker processes. Defaults to the number of CPUs.
+    :param cache_dir: directory of the saved cells. Defaults to `CACHE_DIR`. Not used without a seed.
+    :param solver: name of the solver in the cell keys. Defaults to the qualified name of `run`.
+    :return: points, results: parameter tuples of shape (npoints, len(pnames)) and results of shape
+     (npoints,) + result shape, or design.shape + result shape for grids
+    """
+    cached = seed is not None
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if cached:
+        os.makedirs(cache_dir, exist_ok=True)
+    seed = seed_sequence(seed)
+    solver = solver or '{}.{}'.format(run.__module__, run.__qualname__)
+    cols = [list(pnames).index(n) for n in design.names]
+    points = np.tile(np.asarray(base, dtype=float), (len(design.points), 1))
+    points[:, cols] = design.points
+    if cached:
+        fnames = [os.path.join(cache_dir, cell_key(p, seed, solver) + '.npy') for p in points]
+    else:
+        fnames = [None] * len(points)
+    results = [np.load(f) if f is not None and os.path.exists(f) else None for f in fnames]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            futures = {pool.submit(_run_cell, run, tuple(points[i]), seed, fnames[i]): i for i in todo}
+            for f in as_completed(futures):
+                results[futures[f]] = f.result()
+    results = np.stack(results)
+    if design.shape is not None:
+        results = results.reshape(design.shape + results.shape[1:])
+    return points, results
@@ -0,0 +1,29 @@
+# -*- coding:utf-8 -*-
+u"""
+Import budget of the solver modules: each must import quickly and without plotting code, sympy or scipy,
+so worker processes and scripts only pay for what they run. The same holds for the compiled kernels
+which the workers unpickle. Run with `python -m pytest`.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import pickle
+from benchmark import check_imports, unpickle_cost, CORE_MODULES, HEAVY_MODULES
+
+#: seconds allowed to import each of the core modules, in a fresh interpreter
+IMPORT_BUDGET = 0.5
+
+
+def test_core_imports():
+    errors = check_imports(IMPORT_BUDGET, CORE_MODULES, HEAVY_MODULES)
+    assert not errors, '\n'.join(errors)
+
+
+def test_kernel_unpickling(tmp_path):
+    from modelgen import SerotypeModel
+    m = SerotypeModel(2)
+    path = tmp_path / 'kernels.pkl'
+    with open(path, 'wb') as f:
+        pickle.dump((m.compile(str(tmp_path))[0], m.compile_functions(str(tmp_path))), f)
+    seconds, loaded = unpickle_cost(path, HEAVY_MODULES)
+    assert seconds < IMPORT_BUDGET
+    assert not loaded, 'unpickling the kernels imports {}'.format(', '.join(loaded))
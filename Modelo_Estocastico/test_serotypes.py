@@ -0,0 +1,35 @@
+# -*- coding:utf-8 -*-
+u"""
+Checks the serotype outputs of `serotypes.serotype_summary` on a model whose hosts move to a
+merged R after their second infection, so their infection history is not in the states.
+Run with `python -m pytest`.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import numpy as np
+import SSASolvers
+from modelgen import SerotypeModel
+from serotypes import serotype_summary
+
+
+def test_incidence_merged_recovered(tmp_path):
+    m = SerotypeModel(4, max_infections=2)
+    assert 'R' in m.vnames
+    kernel = m.compile_scalar(str(tmp_path))
+    N = 400
+    params = (N, 4 * (1 / 1.5) / N, 0.5, 1 / 10., 1 / 1.5)
+    inits = np.zeros(len(m.vnames))
+    inits[m.vnames.index('R_1')] = 200
+    for s in '1234':
+        inits[m.vnames.index('I_' + s)] = 5
+    inits[0] = N - inits.sum()
+    grid = np.arange(0, 30, 2.)
+    rec = m.recorder(grid, reps=3)
+    labels, counter = m.counter(grid, reps=3)
+    SSASolvers.GillespieDirect(params, inits, m.tmat, SSASolvers.ScalarKernel(kernel, len(m.transitions)), 30,
+                               reps=3, rng=7, recorder=rec, counter=counter)
+    out = serotype_summary(rec, counter, m.n)
+    assert out['incidence'].shape == (len(grid) - 1, m.n, 3)
+    assert (out['incidence'] >= 0).all()
+    assert out['incidence'].sum() > 0
+    np.testing.assert_allclose(out['attack_rate'], out['incidence'].sum(axis=0) / N)
@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+u"""
+Checks that `SSASolvers.GillespieDirectJIT` follows `GillespieDirect` exactly: for a fixed seed both
+draw the same numbers in the same order, so they return the same trajectories and event counts.
+Run with `python -m pytest`.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import numpy as np
+import pytest
+import SSASolvers
+from modelgen import SerotypeModel
+
+
+@pytest.fixture(scope='module')
+def model(tmp_path_factory):
+    """
+    Two serotype model with its scalar kernel, parameters and initial state
+    """
+    m = SerotypeModel(2)
+    kernel = m.compile_scalar(str(tmp_path_factory.mktemp('cache')))
+    N = 300
+    params = (N, 3 * (1 / 1.5) / N, 0.2, 1 / (70 * 52.), 1 / 1.5)
+    inits = np.zeros(len(m.vnames))
+    inits[0] = N - 20
+    inits[m.vnames.index('I_1')] = inits[m.vnames.index('I_2')] = 10
+    return m, kernel, params, inits
+
+
+def _compare(model):
+    m, kernel, params, inits = model
+    grid = np.linspace(0, 19, 13)
+    runs = []
+    for solver, propensity in ((SSASolvers.GillespieDirect, SSASolvers.ScalarKernel(kernel, len(m.transitions))),
+                               (SSASolvers.GillespieDirectJIT, kernel)):
+        labels, counter = m.counter(np.arange(0, 20, 2.5), reps=3)
+        rec = SSASolvers.GridRecorder(grid, len(inits), 3)
+        t, series, steps = solver(params, inits, m.tmat, propensity, 20, reps=3, rng=42, recorder=rec,
+                                  counter=counter)
+        runs.append((series, steps, counter.counts))
+    (s1, n1, c1), (s2, n2, c2) = runs
+    assert n1 == n2 > 0
+    np.testing.assert_array_equal(s1, s2)
+    np.testing.assert_array_equal(c1, c2)
+
+
+def test_direct_jit_compiled(model):
+    pytest.importorskip('numba')
+    _compare(model)
+
+
+def test_direct_jit_event_loop(model, monkeypatch):
+    # the same event loop, run by the interpreter
+    monkeypatch.setattr(SSASolvers, '_jit', lambda f, cache=False: f)
+    _compare(model)
@@ -0,0 +1,173 @@
+# -*- coding:utf-8 -*-
+u"""
+Chunked on-disk store for ensembles of trajectories, laid out as (replicate, time, state).
+A store is a directory with one file per chunk of replicates, written as batches finish, and
+`meta.json` with the sampling times, variable names, parameters and the chunk index. Chunks
+are compressed `.npz` files, or plain `.npy` files which are read back as memory maps.
+Ensembles larger than the memory are read chunk by chunk or with lazy slices.
+Created on 18/10/26
+license: GPL V3 or Later
+"""
+import os
+import json
+import numpy as np
+
+META = 'meta.json'
+
+
+def _jsonable(v):
+    """
+    Converts parameters (NumPy or sympy numbers, tuples) to JSON types
+    """
+    if isinstance(v, dict):
+        return {str(k): _jsonable(i) for k, i in v.items()}
+    if isinstance(v, (list, tuple, np.ndarray)):
+        return [_jsonable(i) for i in v]
+    if isinstance(v, (bool, str)) or v is None:
+        return v
+    if isinstance(v, (int, np.integer)):
+        return int(v)
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return str(v)
+
+
+class TrajectoryStore(object):
+    """
+    Opens an existing store. New stores are made with `TrajectoryStore.create`.
+    Slicing reads only the chunks holding the selected replicates, e.g. `store[:100, -1]` returns
+    the final states of the first 100 replicates. Only the replicate index may be an array.
+    :param path: directory of the store
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        self.times = np.load(os.path.join(path, 'times.npy'))
+        self.vnames = self.meta['vnames']
+        self.params = self.meta['params']
+        self.attrs = self.meta['attrs']
+        self.dtype = np.dtype(self.meta['dtype'])
+
+    @classmethod
+    def create(cls, path, times, vnames, params=None, dtype=float, compress=True, **attrs):
+        """
+        Creates an empty store.
+        :param path: directory of the store, created if needed. It must not hold another store.
+        :param times: sampling times
+        :param vnames: variable names
+        :param params: parameter tuple of the model
+        :param dtype: dtype of the stored states
+        :param compress: write compressed `.npz` chunks instead of `.npy` files which can be memory mapped
+        :param attrs: other metadata, e.g. the seed or the solver
+        :return: `TrajectoryStore`
+        """
+        if os.path.exists(os.path.join(path, META)):
+            raise ValueError("{} already holds a trajectory store".format(path))
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'times.npy'), np.asarray(times))
+        meta = {'vnames': list(vnames), 'params': _jsonable(params), 'attrs': _jsonable(attrs),
+                'dtype': np.dtype(dtype).str, 'compress': compress, 'chunks': []}
+        cls._write_meta(path, meta)
+        return cls(path)
+
+    @staticmethod
+    def _write_meta(path, meta):
+        """
+        Replaces `meta.json` atomically, so a store interrupted mid-run can still be opened
+        """
+        tmp = os.path.join(path, '{}.{}.tmp'.format(META, os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, os.path.join(path, META))
+
+    @property
+    def chunk_index(self):
+        """
+        List of (first replicate, number of replicates, file name) of the chunks written
+        """
+        return [tuple(c) for c in self.meta['chunks']]
+
+    @property
+    def shape(self):
+        """
+        (replicates, times, states). Replicates never written read as NaN.
+        """
+        nreps = max([s + n for s, n, _ in self.chunk_index] or [0])
+        return nreps, self.times.size, len(self.vnames)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def write(self, start, data):
+        """
+        Writes a chunk of replicates.
+        :param start: number of the first replicate in `data`
+        :param data: array of shape (replicates, times, states)
+        """
+        data = np.asarray(data, dtype=self.dtype)
+        if data.shape[1:] != self.shape[1:]:
+            raise ValueError("Expected chunks of shape (n, {}, {}), got {}".format(
+                self.shape[1], self.shape[2], data.shape))
+        name = 'chunk_{:09d}'.format(start)
+        if self.meta['compress']:
+            name += '.npz'
+            np.savez_compressed(os.path.join(self.path, name), data=data)
+        else:
+            name += '.npy'
+            np.save(os.path.join(self.path, name), data)
+        self.meta['chunks'].append([int(start), int(data.shape[0]), name])
+        self._write_meta(self.path, self.meta)
+
+    def _load(self, name):
+        fname = os.path.join(self.path, name)
+        if name.endswith('.npz'):
+            with np.load(fname) as f:
+                return f['data']
+        return np.load(fname, mmap_mode='r')
+
+    def chunks(self):
+        """
+        Iterates over the chunks, in replicate order, as (first replicate, array) pairs,
+        holding a single chunk in memory at a time
+        """
+        for start, n, name in sorted(self.chunk_index):
+            yield start, self._load(name)
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        rest = key[1:]
+        nreps, ntimes, nvars = self.shape
+        ids = np.arange(nreps)[key[0]]
+        scalar = np.ndim(ids) == 0
+        ids = np.atleast_1d(ids)
+        tail = np.empty((1, ntimes, nvars))[(slice(None),) + rest].shape[1:]
+        out = np.full((ids.size,) + tail, np.nan)
+        for start, n, name in self.chunk_index:
+            sel = (ids >= start) & (ids < start + n)
+            if sel.any():
+                out[sel] = self._load(name)[(ids[sel] - start,) + rest]
+        return out[0] if scalar else out
+
+    def memmap(self, fname=None):
+        """
+        The whole ensemble as a read-only memory map, of shape (replicates, times, states).
+        The chunks are copied once into a single `.npy` file, `fname`, which defaults to
+        `all.npy` in the store and is reused while no chunks are added.
+        :return: `numpy.memmap`
+        """
+        fname = fname or os.path.join(self.path, 'all.npy')
+        shape = self.shape
+        if os.path.exists(fname):
+            m = np.load(fname, mmap_mode='r')
+            if m.shape == shape and os.path.getmtime(fname) >= os.path.getmtime(os.path.join(self.path, META)):
+                return m
+            del m
+        m = np.lib.format.open_memmap(fname, mode='w+', dtype=self.dtype, shape=shape)
+        m[:] = np.nan if self.dtype.kind == 'f' else 0
+        for start, data in self.chunks():
+            m[start:start + data.shape[0]] = data
+        m.flush()
+        del m
+        return np.load(fname, mmap_mode='r')